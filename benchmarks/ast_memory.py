@@ -0,0 +1,45 @@
+'''Measure the memory the syntax tree of a large program takes.
+
+    python -m benchmarks.ast_memory [functions]
+'''
+import sys
+import tracemalloc
+
+from lox import lox
+from lox.optimizer import _nodes
+from lox.parser import Parser
+from lox.scanner import Scanner
+
+FUNCTIONS = 20000
+
+def program(functions):
+    return ''.join(f'''
+fun f{i}(a, b) {{
+    var total = a * {i} + b;
+    for (var j = 0; j < 10; j = j + 1) {{
+        if (total >= 100 and j != 5) print "big"; else total = total - 1;
+    }}
+    return f{i}(total, -b) / 2;
+}}
+''' for i in range(functions))
+
+def measure(functions):
+    l = lox.Lox()
+    source = program(functions)
+    tracemalloc.start()
+    try:
+        statements = Parser(Scanner(source, l).scan(), l).parse()
+        l.resolver.resolve(statements)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    nodes = sum(len(list(_nodes(statement))) for statement in statements)
+    return nodes, size
+
+def main(functions):
+    nodes, size = measure(functions)
+    print(f'{nodes:,} nodes: {size / 1e6:.1f} MB, '
+          f'{size / nodes:.0f} bytes per node')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else FUNCTIONS)
@@ -0,0 +1,40 @@
+'''Measure how many Lox calls per second every engine makes.
+
+    python -m benchmarks.calls [engine ...]
+'''
+import contextlib
+import io
+import sys
+import time
+
+from lox import lox
+
+CALLS = 100000
+
+PROGRAM = f'''
+fun add(a, b) {{
+    return a + b;
+}}
+var i = 0;
+var total = 0;
+while (i < {CALLS}) {{
+    total = add(total, i);
+    i = i + 1;
+}}
+print total;
+'''
+
+def calls_per_second(engine):
+    l = lox.Lox(engine=engine)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        l.run(PROGRAM)
+        elapsed = time.perf_counter() - start
+    return CALLS / elapsed
+
+def main(engines):
+    for engine in engines or sorted(lox.ENGINES):
+        print(f'{engine:>10}: {calls_per_second(engine):12,.0f} calls/s')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,7 +1,14 @@
 class Expr:
-    pass
+    # Nodes declare their fields in `__slots__`, rather than keeping them in
+    # a `__dict__`: there can be hundreds of thousands of them.
+    __slots__ = ()
 
 class Binary(Expr):
+    # `function`, `slot` and `constant` are only set when the `Interpreter`
+    # specializes the node, see below: the specialized classes can't add
+    # fields of their own, and still take the place of `Binary`.
+    __slots__ = ('left', 'operator', 'right', 'function', 'slot', 'constant')
+
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -11,6 +18,8 @@ class Binary(Expr):
         return visitor.visit_BinaryExpr(self)
 
 class Grouping(Expr):
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -18,6 +27,8 @@ class Grouping(Expr):
         return visitor.visit_GroupingExpr(self)
 
 class Literal(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -25,6 +36,8 @@ class Literal(Expr):
         return visitor.visit_LiteralExpr(self)
 
 class Unary(Expr):
+    __slots__ = ('operator', 'right')
+
     def __init__(self, operator, right):
         self.operator = operator
         self.right = right
@@ -33,21 +46,38 @@ class Unary(Expr):
         return visitor.visit_UnaryExpr(self)
 
 class Variable(Expr):
+    __slots__ = ('name', 'depth', 'slot', 'cell', 'binding')
+
     def __init__(self, name):
         self.name = name
+        # Set by the resolver for locals, see `Resolver._bind`.
+        self.depth = None
+        self.slot = None
+        self.cell = False
+        # For globals, the `Cell` of the global, once it was looked up.
+        self.binding = None
 
     def accept(self, visitor):
         return visitor.visit_VariableExpr(self)
 
 class Assign(Expr):
+    __slots__ = ('name', 'value', 'depth', 'slot', 'cell', 'binding')
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        # Set by the resolver, like for `Variable`.
+        self.depth = None
+        self.slot = None
+        self.cell = False
+        self.binding = None
 
     def accept(self, visitor):
         return visitor.visit_AssignExpr(self)
 
 class Logical(Expr):
+    __slots__ = ('left', 'right', 'operator')
+
     def __init__(self, left, operator, right):
         self.left = left
         self.right = right
@@ -57,10 +87,65 @@ class Logical(Expr):
         return visitor.visit_LogicalExpr(self)
 
 class Call(Expr):
+    __slots__ = ('callee', 'paren', 'arguments', 'tail', 'checked_callee')
+
     def __init__(self, callee, paren, arguments):
         self.callee = callee
         self.paren = paren
         self.arguments = arguments
+        # Set by the resolver for `return f(x);`, where the caller has nothing
+        # left to do but return the result.
+        self.tail = False
+        # A weak reference to the last callee which passed the checks at
+        # this call site. The number of arguments never changes, so calling
+        # it again needs no checking. Being weak, it doesn't keep the callee,
+        # or what the callee holds on to, alive.
+        self.checked_callee = None
 
     def accept(self, visitor):
         return visitor.visit_CallExpr(self)
+
+# `Binary` nodes which the `Interpreter` specialized for the operand types it
+# has seen, see `Interpreter._specialize`. Other visitors treat them as
+# ordinary `Binary` nodes.
+
+class FloatAdd(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_FloatAddExpr(self)
+
+class StringConcat(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_StringConcatExpr(self)
+
+class FloatArithmetic(Binary):
+    '''`-`, `*` or `/`, computed by `function`.'''
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_FloatArithmeticExpr(self)
+
+class FloatCompare(Binary):
+    '''A comparison, computed by `function`.'''
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_FloatCompareExpr(self)
+
+class LocalCompare(Binary):
+    '''A comparison of a local in the current scope, at `slot`, with the
+    number `constant`.
+    '''
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_LocalCompareExpr(self)
+
+class GenericBinary(Binary):
+    '''A `Binary` which has seen operand types that vary, and is no longer
+    specialized.
+    '''
+    __slots__ = ()
@@ -1,25 +1,115 @@
-from lox.environment import Environment
+from lox.environment import Cell, Environment
 from lox.LoxCallable import LoxCallable
-from lox.loxreturn import Return
+
+def capture(declaration, environment):
+    '''The cells of the free variables of the function `declaration`, which
+    is declared in `environment`.
+    '''
+    return tuple(
+        environment.getat(depth, slot) for depth, slot, _ in declaration.free)
+
+class TailCall:
+    '''Returned by a function body instead of making a call in tail
+    position. The caller's `LoxFunction.__call__` makes the call instead, so
+    tail recursion runs in constant Python stack.
+    '''
+    __slots__ = ('function', 'arguments')
+
+    def __init__(self, function, arguments):
+        self.function = function
+        self.arguments = arguments
 
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration, closure):
+    # Shadows `LoxCallable.arity`, so that it can be set per function.
+    arity = None
+
+    def __init__(self, declaration, cells, memo=None):
         self.declaration = declaration
-        self.closure = closure
+        # The `Memo` of a pure function, when its calls are memoized.
+        self.memo = memo
+        # The layout of a frame, worked out once rather than on every call.
+        # Parameters take the first slots of the function's scope, and the
+        # other slots start out as nil.
+        self.arity = len(declaration.params)
+        self.padding = [None] * (declaration.size - self.arity)
+        self.cell_params = declaration.cell_params
+        # Only the free variables are captured, not the declaring
+        # environment. A function without any holds no link to it at all.
+        # Each cell is kept with the slot it takes in the frame.
+        self.free = tuple(
+            (target, cell)
+            for (_, _, target), cell in zip(declaration.free, cells))
+
+    def _frame(self, arguments, pool=None):
+        '''The environment of a call with `arguments`, taken from `pool`
+        if there is one.
+        '''
+        if pool == None:
+            environment = Environment.of(arguments + self.padding)
+            values = environment.values
+        else:
+            environment = pool.acquire(None, self.declaration.size)
+            values = environment.values
+            values[:self.arity] = arguments
+        if self.cell_params:
+            for slot in self.cell_params:
+                values[slot] = Cell(values[slot])
+        if self.free:
+            for target, cell in self.free:
+                values[target] = cell
+        return environment
+
+    def _run(self, interpreter, arguments):
+        '''Run the body, and return the result or a `TailCall`.'''
+        pool = interpreter.pool
+        # The frame is only referenced while the body runs, and by the
+        # closures created in it.
+        if pool == None:
+            return interpreter._execute_body(
+                self.declaration, self._frame(arguments))
+        frame = self._frame(arguments, pool)
+        result = interpreter._execute_body(self.declaration, frame)
+        pool.release(frame)
+        return result
 
     def __call__(self, interpreter, arguments):
-        self.environment = Environment(self.closure)
-        for i in range(len(self.declaration.params)):
-            self.environment.define(
-                self.declaration.params[i].lexeme, arguments[i])
-        try:
-            interpreter._execute_block(self.declaration.body, self.environment)
-        except Return as ret:
-            return ret.value
-
-    @property
-    def arity(self):
-        return len(self.declaration.params)
+        if self.memo is not None:
+            return _memoized_call(self, interpreter, arguments)
+        result = self._run(interpreter, arguments)
+        while type(result) is TailCall:
+            function = result.function
+            if function.memo is not None:
+                return _memoized_call(function, interpreter, result.arguments)
+            result = function._run(interpreter, result.arguments)
+        return result
 
     def __str__(self):
         return f"<fn {self.declaration.name.lexeme}>"
+
+def _memoized_call(function, interpreter, arguments):
+    '''Call `function`, looking the result up in its memo first. The tail
+    calls it makes are run in the same loop as in `LoxFunction.__call__`, and
+    all return the same result, which is kept for each that has a memo.
+    '''
+    pending = []
+    while True:
+        memo = function.memo
+        if memo is not None and memo.valid():
+            key = memo.key(arguments)
+            results = memo.results
+            if key in results:
+                memo.hits += 1
+                results.move_to_end(key)
+                result = results[key]
+                break
+            memo.misses += 1
+            pending.append((memo, key))
+        result = function._run(interpreter, arguments)
+        if type(result) is not TailCall:
+            break
+        function = result.function
+        arguments = result.arguments
+    # The outermost call is kept last, as the most recently used.
+    for memo, key in reversed(pending):
+        memo.store(key, result)
+    return result
@@ -3,12 +3,15 @@ class Stmt:
        Decl -> VarDcl | Stmt
        Stmt -> ExprStmt | PrintStmt
     '''
-    pass
+    # Like `Expr.Expr`, nodes keep their fields in `__slots__`.
+    __slots__ = ()
 
 class Expression(Stmt):
     '''
        ExprStmt -> expression ";"
     '''
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -16,6 +19,8 @@ class Expression(Stmt):
         return visitor.visit_ExpressionStmt(self)
 
 class Print(Stmt):
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -23,22 +28,36 @@ class Print(Stmt):
         return visitor.visit_PrintStmt(self)
 
 class Var(Stmt):
+    __slots__ = ('name', 'initializer', 'slot', 'cell')
+
     def __init__(self, name, initializer):
         self.name = name
         self.initializer = initializer
+        # Set by the resolver, `None` for globals. `cell` is set when the
+        # variable is captured by a closure, and so is stored in a `Cell`.
+        self.slot = None
+        self.cell = False
 
     def accept(self, visitor):
         return visitor.visit_VarStmt(self)
 
 class Block(Stmt):
+    __slots__ = ('statements', 'size')
+
     def __init__(self, statements):
         self.statements = statements
+        # Number of variables declared in the block, set by the resolver. A
+        # block which declares none doesn't need an `Environment`.
+        self.size = 0
 
     def accept(self, visitor):
         return visitor.visit_BlockStmt(self)
 
 class If(Stmt):
-    def __init__(self, condition, then_branch, else_branch):
+    __slots__ = ('keyword', 'condition', 'then_branch', 'else_branch')
+
+    def __init__(self, keyword, condition, then_branch, else_branch):
+        self.keyword = keyword
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
@@ -47,23 +66,57 @@ class If(Stmt):
         return visitor.visit_IfStmt(self)
 
 class While(Stmt):
-    def __init__(self, condition, body):
+    __slots__ = ('keyword', 'condition', 'body', 'count', 'compiled')
+
+    def __init__(self, keyword, condition, body):
+        self.keyword = keyword
         self.condition = condition
         self.body = body
+        # Iterations so far, and the loop once compiled, for the
+        # `TieredInterpreter`.
+        self.count = 0
+        self.compiled = None
 
     def accept(self, visitor):
         return visitor.visit_WhileStmt(self)
 
 class Function(Stmt):
+    __slots__ = (
+        'name', 'params', 'body', 'slot', 'cell', 'size', 'cell_params',
+        'free', 'pure', 'globals', 'memo', 'count', 'compiled')
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
         self.body = body
+        # Set by the resolver, like for `Var` and `Block`. `size` counts the
+        # parameters, and the variables declared in the body.
+        self.slot = None
+        self.cell = False
+        self.size = 0
+        # The captured parameters, and `(depth, slot, target)` for every free
+        # variable: where its `Cell` is found from the declaring environment,
+        # and the slot it takes in the function's own.
+        self.cell_params = []
+        self.free = []
+        # Whether the function is pure, as far as the resolver can tell: it
+        # doesn't print, assign to or read variables outside of it, declare
+        # functions, or call anything but globals. The result still depends
+        # on the `globals` it reads, which have to hold pure functions or
+        # values for its calls to be memoized, in `memo`.
+        self.pure = False
+        self.globals = set()
+        self.memo = None
+        # Calls so far, and the body once compiled, like for `While`.
+        self.count = 0
+        self.compiled = None
 
     def accept(self, visitor):
         return visitor.visit_FunctionStmt(self)
 
 class Return(Stmt):
+    __slots__ = ('keyword', 'value')
+
     def __init__(self, keyword, value):
         self.keyword = keyword
         self.value = value
@@ -1,7 +1,8 @@
 from lox import Expr
+from lox.interpreter import stringify
 from lox.visitor import Visitor
 from lox.token import Token
-from lox.tokentype import TokenType
+from lox.tokentype import MINUS, STAR
 
 class ASTPrinter(Visitor):
     def pprint_ast(self, expr):
@@ -22,21 +23,33 @@ class ASTPrinter(Visitor):
         return self.parenthesize('group', expr.expression)
 
     def visit_LiteralExpr(self, expr):
-        if expr.value == 'nil':
-            return 'nil'
-        return str(expr.value)
+        if isinstance(expr.value, str):
+            return f'"{expr.value}"'
+        return stringify(expr.value)
 
     def visit_UnaryExpr(self, expr):
         return self.parenthesize(expr.operator.lexeme, expr.right)
+
+    def visit_LogicalExpr(self, expr):
+        return self.parenthesize(expr.operator.lexeme, expr.left, expr.right)
+
+    def visit_VariableExpr(self, expr):
+        return expr.name.lexeme
+
+    def visit_AssignExpr(self, expr):
+        return self.parenthesize(f'= {expr.name.lexeme}', expr.value)
+
+    def visit_CallExpr(self, expr):
+        return self.parenthesize('call', expr.callee, *expr.arguments)
     
 
 if __name__ == '__main__':
     expression = Expr.Binary(
         Expr.Unary(
-            Token(TokenType.MINUS, '-', None, 1),
+            Token(MINUS, '-', None, 1),
             Expr.Literal(123)
         ),
-        Token(TokenType.STAR, '*', None, 1),
+        Token(STAR, '*', None, 1),
         Expr.Grouping(
             Expr.Literal(45.67)
         )
@@ -0,0 +1,373 @@
+'''Compile resolved `Expr` and `Stmt` trees into nested Python closures.
+
+The tree-walking `Interpreter` pays for `Visitor.visit` -> `accept` ->
+`visit_XExpr` and a chain of operator comparisons every time a node is
+evaluated. `ClosureCompiler` walks the tree only once: every node becomes a
+closure taking the current `Environment`, with its operator, resolved depth
+and constants already bound.
+
+Compiled statements return `None` on normal completion and a one element
+tuple holding the returned value when a `return` statement was executed, so
+that returning from a function doesn't need an exception.
+'''
+import operator
+import weakref
+
+from lox import Expr
+from lox.environment import Cell, Environment
+from lox.exceptions import RuntimeException
+from lox.interpreter import Interpreter, _check_call, stringify
+from lox.LoxFunction import LoxFunction, TailCall, capture
+from lox.tokentype import (BANG_EQUAL, EQUAL_EQUAL, GREATER, GREATER_EQUAL,
+    LESS, LESS_EQUAL, MINUS, OR, PLUS, SLASH, STAR)
+from lox.visitor import Visitor
+
+# Binary operators which only accept two numbers.
+NUMERIC_OPERATORS = {
+    MINUS: operator.sub,
+    STAR: operator.mul,
+    GREATER: operator.gt,
+    GREATER_EQUAL: operator.ge,
+    LESS: operator.lt,
+    LESS_EQUAL: operator.le,
+}
+
+class CompiledFunction(LoxFunction):
+    def __init__(self, declaration, cells, body, memo=None):
+        super().__init__(declaration, cells, memo)
+        self.body = body
+
+    def _run(self, interpreter, arguments):
+        completion = self.body(self._frame(arguments))
+        if completion is not None:
+            return completion[0]
+
+class ClosureCompiler(Visitor):
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.global_env = interpreter.global_env
+
+    def compile(self, statements):
+        return self._compile_block(statements)
+
+    def _compile(self, expr_or_stmt):
+        return self.visit(expr_or_stmt)
+
+    def _compile_block(self, statements):
+        compiled = [self._compile(statement) for statement in statements]
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def block(env):
+            for statement in compiled:
+                completion = statement(env)
+                if completion is not None:
+                    return completion
+        return block
+
+    def visit_LiteralExpr(self, expr):
+        value = expr.value
+
+        def literal(env):
+            return value
+        return literal
+
+    def visit_GroupingExpr(self, expr):
+        return self._compile(expr.expression)
+
+    def visit_UnaryExpr(self, expr):
+        right = self._compile(expr.right)
+        op = expr.operator
+
+        if op.tokentype == MINUS:
+            def negate(env):
+                value = right(env)
+                if not isinstance(value, float):
+                    raise RuntimeException(op, 'Operand must be a number.')
+                return -value
+            return negate
+
+        def bang(env):
+            value = right(env)
+            return value is None or value is False
+        return bang
+
+    def visit_BinaryExpr(self, expr):
+        left = self._compile(expr.left)
+        right = self._compile(expr.right)
+        op = expr.operator
+        tokentype = op.tokentype
+
+        if tokentype == PLUS:
+            def add(env):
+                a = left(env)
+                b = right(env)
+                # This handles both the cases - when (a, b) are float or str
+                try:
+                    return a + b
+                except TypeError:
+                    raise RuntimeException(
+                        op, 'Operands must be two numbers or two strings.')
+            return add
+        elif tokentype == SLASH:
+            def divide(env):
+                a = left(env)
+                b = right(env)
+                if not (isinstance(a, float) and isinstance(b, float)):
+                    raise RuntimeException(op, 'Operand must be a number.')
+                if b == 0:
+                    raise RuntimeException(op, "Cannot divide by zero.")
+                return a / b
+            return divide
+        elif tokentype == EQUAL_EQUAL:
+            def equal(env):
+                return left(env) == right(env)
+            return equal
+        elif tokentype == BANG_EQUAL:
+            def not_equal(env):
+                return left(env) != right(env)
+            return not_equal
+
+        function = NUMERIC_OPERATORS[tokentype]
+
+        def numeric(env):
+            a = left(env)
+            b = right(env)
+            if not (isinstance(a, float) and isinstance(b, float)):
+                raise RuntimeException(op, 'Operand must be a number.')
+            return function(a, b)
+        return numeric
+
+    def visit_VariableExpr(self, expr):
+        name = expr.name
+        if expr.depth == None:
+            global_env = self.global_env
+            binding = None
+
+            def global_variable(env):
+                nonlocal binding
+                if binding is None:
+                    binding = global_env.cell(name)
+                return binding.value
+            return global_variable
+
+        distance, slot = expr.depth, expr.slot
+        if expr.cell:
+            if distance == 0:
+                def current_cell(env):
+                    return env.values[slot].value
+                return current_cell
+
+            def ancestor_cell(env):
+                return env.ancestor(distance).values[slot].value
+            return ancestor_cell
+        elif distance == 0:
+            def current(env):
+                return env.values[slot]
+            return current
+        elif distance == 1:
+            def enclosing(env):
+                return env.enclosing.values[slot]
+            return enclosing
+
+        def ancestor(env):
+            return env.ancestor(distance).values[slot]
+        return ancestor
+
+    def visit_AssignExpr(self, expr):
+        name = expr.name
+        value = self._compile(expr.value)
+        if expr.depth == None:
+            global_env = self.global_env
+            binding = None
+
+            def assign_global(env):
+                nonlocal binding
+                result = value(env)
+                if binding is None:
+                    binding = global_env.assign(name, result)
+                else:
+                    binding.value = result
+                return result
+            return assign_global
+
+        distance, slot = expr.depth, expr.slot
+        if expr.cell:
+            def assign_cell(env):
+                result = value(env)
+                env.ancestor(distance).values[slot].value = result
+                return result
+            return assign_cell
+
+        def assign(env):
+            result = value(env)
+            env.ancestor(distance).values[slot] = result
+            return result
+        return assign
+
+    def visit_LogicalExpr(self, expr):
+        left = self._compile(expr.left)
+        right = self._compile(expr.right)
+
+        if expr.operator.tokentype == OR:
+            def logical_or(env):
+                value = left(env)
+                if value is None or value is False:
+                    return right(env)
+                return value
+            return logical_or
+
+        def logical_and(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+        return logical_and
+
+    def visit_CallExpr(self, expr):
+        callee = self._compile(expr.callee)
+        arguments = [self._compile(argument) for argument in expr.arguments]
+        interpreter = self.interpreter
+        tail = expr.tail
+
+        # A weak reference to the last callee which passed the checks, like
+        # `Expr.Call`'s `checked_callee`.
+        checked = None
+
+        def call(env):
+            nonlocal checked
+            function = callee(env)
+            values = [argument(env) for argument in arguments]
+            if checked is None or checked() is not function:
+                _check_call(expr, function, values)
+                checked = weakref.ref(function)
+            if tail and isinstance(function, LoxFunction):
+                return TailCall(function, values)
+            return function(interpreter, values)
+        return call
+
+    def visit_ExpressionStmt(self, stmt):
+        expression = self._compile(stmt.expression)
+
+        def expression_statement(env):
+            expression(env)
+        return expression_statement
+
+    def visit_PrintStmt(self, stmt):
+        expression = self._compile(stmt.expression)
+
+        def print_statement(env):
+            print(stringify(expression(env)))
+        return print_statement
+
+    def _compile_define(self, declaration, value):
+        '''Compile storing the result of `value` in the variable declared by
+        `declaration`.
+        '''
+        slot = declaration.slot
+        if slot == None:
+            name = declaration.name.lexeme
+            define_global_variable = self.global_env.define
+
+            def define_global(env):
+                define_global_variable(name, value(env))
+            return define_global
+        elif declaration.cell:
+            def define_cell(env):
+                env.values[slot] = Cell(value(env))
+            return define_cell
+
+        def define(env):
+            env.values[slot] = value(env)
+        return define
+
+    def visit_VarStmt(self, stmt):
+        if stmt.initializer == None:
+            return self._compile_define(stmt, self._compile(Expr.Literal(None)))
+        return self._compile_define(stmt, self._compile(stmt.initializer))
+
+    def visit_BlockStmt(self, stmt):
+        body = self._compile_block(stmt.statements)
+        size = stmt.size
+        if size == 0:
+            return body
+
+        def block(env):
+            return body(Environment(env, size))
+        return block
+
+    def visit_IfStmt(self, stmt):
+        condition = self._compile(stmt.condition)
+        then_branch = self._compile(stmt.then_branch)
+        if stmt.else_branch == None:
+            def if_statement(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return then_branch(env)
+            return if_statement
+
+        else_branch = self._compile(stmt.else_branch)
+
+        def if_else_statement(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                return then_branch(env)
+            return else_branch(env)
+        return if_else_statement
+
+    def visit_WhileStmt(self, stmt):
+        condition = self._compile(stmt.condition)
+        body = self._compile(stmt.body)
+
+        def while_statement(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return
+                completion = body(env)
+                if completion is not None:
+                    return completion
+        return while_statement
+
+    def visit_FunctionStmt(self, stmt):
+        body = self._compile_block(stmt.body)
+        memo = self.interpreter._memo
+
+        if stmt.cell:
+            slot = stmt.slot
+
+            # The function captures itself, so its cell has to exist first.
+            def define_function_cell(env):
+                cell = env.values[slot] = Cell(None)
+                cell.value = CompiledFunction(
+                    stmt, capture(stmt, env), body, memo(stmt))
+            return define_function_cell
+
+        def function(env):
+            return CompiledFunction(stmt, capture(stmt, env), body, memo(stmt))
+        return self._compile_define(stmt, function)
+
+    def visit_ReturnStmt(self, stmt):
+        if stmt.value == None:
+            def return_nil(env):
+                return (None,)
+            return return_nil
+
+        value = self._compile(stmt.value)
+
+        def return_statement(env):
+            return (value(env),)
+        return return_statement
+
+class ClosureInterpreter(Interpreter):
+    '''Runs programs by compiling them with `ClosureCompiler` first.
+
+    The resolved depths are shared with the tree-walking `Interpreter`, so both
+    engines agree on how every variable is bound.
+    '''
+    def interpret(self, statements):
+        program = ClosureCompiler(self).compile(statements)
+        try:
+            program(self.environment)
+        except RuntimeException as err:
+            self.lox.runtime_error(err)
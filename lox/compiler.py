@@ -0,0 +1,383 @@
+'''Lower resolved `Expr` and `Stmt` trees to bytecode for `lox.vm.VM`.
+
+Every function (and the top-level script) is compiled to a `FunctionProto`
+holding a compact `array` of opcodes and their operands, a constant pool, a
+line table and the number of local slots it needs.
+
+Locals live in the slots of their function's frame, blocks only reserve more
+slots. Locals which are captured by a nested function are stored in a `Cell`
+instead, and closures capture those cells rather than whole scopes. Because a
+captured variable only turns out to be captured once the nested function has
+been compiled, every access to a local is recorded and patched to its cell
+variant when that happens.
+'''
+from array import array
+
+from lox.visitor import Visitor
+
+# Opcodes. Operands, if any, follow the opcode in the code array.
+CONSTANT = 0              # index into the constant pool
+NIL = 1
+TRUE = 2
+FALSE = 3
+POP = 4
+GET_LOCAL = 5             # slot
+SET_LOCAL = 6             # slot
+DEFINE_LOCAL = 7          # slot
+GET_CELL = 8              # slot
+SET_CELL = 9              # slot
+DEFINE_CELL = 10          # slot
+NEW_CELL = 11             # slot
+GET_FREE = 12             # index of the free cell
+SET_FREE = 13             # index of the free cell
+GET_GLOBAL = 14           # constant holding the name
+SET_GLOBAL = 15           # constant holding the name
+DEFINE_GLOBAL = 16        # constant holding the name
+EQUAL = 17
+NOT_EQUAL = 18
+ADD = 19
+# The numeric operators, from SUBTRACT to LESS_EQUAL, must stay contiguous.
+SUBTRACT = 20
+MULTIPLY = 21
+DIVIDE = 22
+GREATER = 23
+GREATER_EQUAL = 24
+LESS = 25
+LESS_EQUAL = 26
+NOT = 27
+NEGATE = 28
+PRINT = 29
+JUMP = 30                 # absolute target
+POP_JUMP_IF_FALSE = 31    # absolute target
+JUMP_IF_FALSE_OR_POP = 32 # absolute target
+JUMP_IF_TRUE_OR_POP = 33  # absolute target
+CALL = 34                 # argument count
+CLOSURE = 35              # constant holding a `FunctionProto`
+RETURN = 36
+
+# Operand-less opcodes for the binary operators, keyed by lexeme.
+BINARY_OPCODES = {
+    '==': EQUAL, '!=': NOT_EQUAL,
+    '>': GREATER, '>=': GREATER_EQUAL, '<': LESS, '<=': LESS_EQUAL,
+    '+': ADD, '-': SUBTRACT, '*': MULTIPLY, '/': DIVIDE,
+}
+
+# Accesses of a local which turns out to be captured are patched to these.
+CELL_OPCODES = {
+    GET_LOCAL: GET_CELL, SET_LOCAL: SET_CELL, DEFINE_LOCAL: DEFINE_CELL,
+}
+
+class FunctionProto:
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        self.code = array('i')
+        self.lines = array('i')
+        self.constants = []
+        self.slot_count = arity
+        # Parameters which are captured, and have to be wrapped in cells when
+        # the frame is created.
+        self.cell_params = []
+        # How to find each free variable when the closure is created:
+        # (True, slot) for a local of the enclosing function and
+        # (False, index) for one of the enclosing function's own free cells.
+        self.free = []
+
+class Local:
+    def __init__(self, name, slot):
+        self.name = name
+        self.slot = slot
+        self.captured = False
+        # Offsets of the instructions which access this local by slot.
+        self.accesses = []
+
+class FunctionCompiler:
+    def __init__(self, enclosing, name=None, params=()):
+        self.enclosing = enclosing
+        self.proto = FunctionProto(name, len(params))
+        self.scopes = [[]]
+        self.free_names = {}
+        self.constant_indices = {}
+        for param in params:
+            self.declare(param.lexeme)
+
+    @property
+    def in_function(self):
+        return self.enclosing != None
+
+    @property
+    def is_global_scope(self):
+        return (not self.in_function) and len(self.scopes) == 1
+
+    def emit(self, line, opcode, *operands):
+        self.proto.code.append(opcode)
+        self.proto.lines.append(line)
+        for operand in operands:
+            self.proto.code.append(operand)
+            self.proto.lines.append(line)
+        return len(self.proto.code) - len(operands) - 1
+
+    def emit_jump(self, line, opcode):
+        '''Emit a jump whose target gets patched later with `patch_jump`.'''
+        return self.emit(line, opcode, -1) + 1
+
+    def patch_jump(self, offset):
+        self.proto.code[offset] = len(self.proto.code)
+
+    def make_constant(self, value):
+        # Python considers `1.0 == True` and `0.0 == -0.0`, Lox constants
+        # don't.
+        key = (type(value), value, str(value))
+        if key not in self.constant_indices:
+            self.constant_indices[key] = len(self.proto.constants)
+            self.proto.constants.append(value)
+        return self.constant_indices[key]
+
+    def declare(self, name):
+        slot = sum(len(scope) for scope in self.scopes)
+        local = Local(name, slot)
+        self.scopes[-1].append(local)
+        self.proto.slot_count = max(self.proto.slot_count, slot + 1)
+        return local
+
+    def begin_scope(self):
+        self.scopes.append([])
+
+    def end_scope(self):
+        self.scopes.pop()
+
+    def resolve_local(self, name):
+        for scope in reversed(self.scopes):
+            for local in reversed(scope):
+                if local.name == name:
+                    return local
+
+    def resolve_free(self, name):
+        '''Index of `name` among this function's free cells, or `None`.'''
+        if not self.in_function:
+            return
+        if name in self.free_names:
+            return self.free_names[name]
+        local = self.enclosing.resolve_local(name)
+        if local != None:
+            self.enclosing.capture(local)
+            return self._add_free(name, True, local.slot)
+        index = self.enclosing.resolve_free(name)
+        if index != None:
+            return self._add_free(name, False, index)
+
+    def _add_free(self, name, is_local, index):
+        self.proto.free.append((is_local, index))
+        self.free_names[name] = len(self.proto.free) - 1
+        return self.free_names[name]
+
+    def capture(self, local):
+        if local.captured:
+            return
+        local.captured = True
+        for offset in local.accesses:
+            code = self.proto.code
+            code[offset] = CELL_OPCODES[code[offset]]
+        if local.slot < self.proto.arity:
+            self.proto.cell_params.append(local.slot)
+
+    def emit_local(self, line, opcode, local):
+        if local.captured:
+            return self.emit(line, CELL_OPCODES[opcode], local.slot)
+        local.accesses.append(self.emit(line, opcode, local.slot))
+
+class Compiler(Visitor):
+    '''Compiles a program with the depths recorded by the `Resolver`.
+
+    The `Resolver` decides whether a variable is global, and the compiler
+    then finds the slot or free cell of every local itself, while it walks
+    the scopes in the same order.
+    '''
+    def __init__(self):
+        self.function = None
+
+    def compile(self, statements):
+        self.function = FunctionCompiler(None)
+        self._compile_statements(statements)
+        self._emit_return(0)
+        return self.function.proto
+
+    def _compile(self, expr_or_stmt):
+        self.visit(expr_or_stmt)
+
+    def _compile_statements(self, statements):
+        for statement in statements:
+            self._compile(statement)
+
+    def _emit_return(self, line):
+        self.function.emit(line, NIL)
+        self.function.emit(line, RETURN)
+
+    def _get_variable(self, expr, name):
+        function = self.function
+        if expr.depth == None:
+            function.emit(
+                name.line, GET_GLOBAL, function.make_constant(name.lexeme))
+            return
+        local = function.resolve_local(name.lexeme)
+        if local != None:
+            function.emit_local(name.line, GET_LOCAL, local)
+        else:
+            function.emit(
+                name.line, GET_FREE, function.resolve_free(name.lexeme))
+
+    def _set_variable(self, expr, name):
+        function = self.function
+        if expr.depth == None:
+            function.emit(
+                name.line, SET_GLOBAL, function.make_constant(name.lexeme))
+            return
+        local = function.resolve_local(name.lexeme)
+        if local != None:
+            function.emit_local(name.line, SET_LOCAL, local)
+        else:
+            function.emit(
+                name.line, SET_FREE, function.resolve_free(name.lexeme))
+
+    def _define_variable(self, name):
+        '''Store the value on top of the stack in a new variable `name`.'''
+        function = self.function
+        if function.is_global_scope:
+            function.emit(
+                name.line, DEFINE_GLOBAL, function.make_constant(name.lexeme))
+            return
+        local = function.declare(name.lexeme)
+        function.emit_local(name.line, DEFINE_LOCAL, local)
+
+    def visit_LiteralExpr(self, expr):
+        # Literals don't carry a token, so they borrow the line of the
+        # instruction before them.
+        function = self.function
+        line = function.proto.lines[-1] if function.proto.lines else 0
+        if expr.value is None:
+            function.emit(line, NIL)
+        elif expr.value is True:
+            function.emit(line, TRUE)
+        elif expr.value is False:
+            function.emit(line, FALSE)
+        else:
+            function.emit(line, CONSTANT, function.make_constant(expr.value))
+
+    def visit_GroupingExpr(self, expr):
+        self._compile(expr.expression)
+
+    def visit_UnaryExpr(self, expr):
+        self._compile(expr.right)
+        opcode = NEGATE if expr.operator.lexeme == '-' else NOT
+        self.function.emit(expr.operator.line, opcode)
+
+    def visit_BinaryExpr(self, expr):
+        self._compile(expr.left)
+        self._compile(expr.right)
+        self.function.emit(
+            expr.operator.line, BINARY_OPCODES[expr.operator.lexeme])
+
+    def visit_LogicalExpr(self, expr):
+        self._compile(expr.left)
+        if expr.operator.lexeme == 'or':
+            opcode = JUMP_IF_TRUE_OR_POP
+        else:
+            opcode = JUMP_IF_FALSE_OR_POP
+        end = self.function.emit_jump(expr.operator.line, opcode)
+        self._compile(expr.right)
+        self.function.patch_jump(end)
+
+    def visit_VariableExpr(self, expr):
+        self._get_variable(expr, expr.name)
+
+    def visit_AssignExpr(self, expr):
+        self._compile(expr.value)
+        self._set_variable(expr, expr.name)
+
+    def visit_CallExpr(self, expr):
+        self._compile(expr.callee)
+        for argument in expr.arguments:
+            self._compile(argument)
+        self.function.emit(expr.paren.line, CALL, len(expr.arguments))
+
+    def visit_ExpressionStmt(self, stmt):
+        self._compile(stmt.expression)
+        self.function.emit(self.function.proto.lines[-1], POP)
+
+    def visit_PrintStmt(self, stmt):
+        self._compile(stmt.expression)
+        self.function.emit(self.function.proto.lines[-1], PRINT)
+
+    def visit_VarStmt(self, stmt):
+        if stmt.initializer == None:
+            self.function.emit(stmt.name.line, NIL)
+        else:
+            self._compile(stmt.initializer)
+        self._define_variable(stmt.name)
+
+    def visit_BlockStmt(self, stmt):
+        self.function.begin_scope()
+        self._compile_statements(stmt.statements)
+        self.function.end_scope()
+
+    def visit_IfStmt(self, stmt):
+        function = self.function
+        self._compile(stmt.condition)
+        line = function.proto.lines[-1]
+        else_branch = function.emit_jump(line, POP_JUMP_IF_FALSE)
+        self._compile(stmt.then_branch)
+        if stmt.else_branch == None:
+            function.patch_jump(else_branch)
+            return
+        end = function.emit_jump(line, JUMP)
+        function.patch_jump(else_branch)
+        self._compile(stmt.else_branch)
+        function.patch_jump(end)
+
+    def visit_WhileStmt(self, stmt):
+        function = self.function
+        start = len(function.proto.code)
+        self._compile(stmt.condition)
+        line = function.proto.lines[-1]
+        end = function.emit_jump(line, POP_JUMP_IF_FALSE)
+        self._compile(stmt.body)
+        function.emit(line, JUMP, start)
+        function.patch_jump(end)
+
+    def visit_FunctionStmt(self, stmt):
+        name = stmt.name
+        enclosing = self.function
+        local = None
+        if not enclosing.is_global_scope:
+            # Declare the function before compiling the body, so that it can
+            # refer to itself.
+            local = enclosing.declare(name.lexeme)
+
+        self.function = FunctionCompiler(enclosing, name.lexeme, stmt.params)
+        self._compile_statements(stmt.body)
+        self._emit_return(name.line)
+        proto = self.function.proto
+        self.function = enclosing
+
+        if local != None and local.captured:
+            # The function refers to itself, so its cell has to exist before
+            # the closure capturing it is created.
+            enclosing.emit(name.line, NEW_CELL, local.slot)
+            enclosing.emit(name.line, CLOSURE, enclosing.make_constant(proto))
+            enclosing.emit(name.line, SET_CELL, local.slot)
+            enclosing.emit(name.line, POP)
+            return
+
+        enclosing.emit(name.line, CLOSURE, enclosing.make_constant(proto))
+        if local == None:
+            enclosing.emit(
+                name.line, DEFINE_GLOBAL, enclosing.make_constant(name.lexeme))
+        else:
+            enclosing.emit_local(name.line, DEFINE_LOCAL, local)
+
+    def visit_ReturnStmt(self, stmt):
+        if stmt.value == None:
+            self.function.emit(stmt.keyword.line, NIL)
+        else:
+            self._compile(stmt.value)
+        self.function.emit(stmt.keyword.line, RETURN)
@@ -1,42 +1,120 @@
 from lox.exceptions import RuntimeException
 
 class Environment:
-    def __init__(self, enclosing=None):
-        self.values = {}
+    '''A local scope. The `Resolver` gives every variable declared in the
+    scope a slot, so values are stored in a list indexed by slot.
+    '''
+    __slots__ = ('values', 'enclosing')
+
+    def __init__(self, enclosing=None, size=0):
+        self.values = [None] * size
         self.enclosing = enclosing
 
+    @classmethod
+    def of(cls, values):
+        '''The frame of a function call, which holds `values` and has no
+        enclosing scope.
+        '''
+        environment = object.__new__(cls)
+        environment.values = values
+        environment.enclosing = None
+        return environment
+
     def ancestor(self, distance):
         for i in range(distance):
             self = self.enclosing
         return self
 
+    def getat(self, distance, slot):
+        return self.ancestor(distance).values[slot]
+
+    def assignat(self, distance, slot, value):
+        self.ancestor(distance).values[slot] = value
+
+class Cell:
+    '''Holds a local variable which is captured by a closure.'''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+class GlobalEnvironment:
+    '''The outermost scope. Globals aren't resolved, so they are looked up by
+    name.
+
+    Every global is held in a `Cell`, which is never replaced once the global
+    is defined. So a reference only needs to look its global up once, and can
+    keep the cell from then on.
+    '''
+    def __init__(self):
+        self.cells = {}
+
     def define(self, name, value):
         ''':param name: str
            :param value: Expr.Literal
         '''
-        self.values[name] = value
+        cell = self.cells.get(name, None)
+        if cell == None:
+            self.cells[name] = Cell(value)
+        else:
+            cell.value = value
+
+    def cell(self, name):
+        '''The cell holding the global `name`, a `Token`.'''
+        cell = self.cells.get(name.lexeme, None)
+        if cell == None:
+            raise RuntimeException(name, f'Undefined name {name.lexeme}.')
+        return cell
 
     def assign(self, name, value):
         ''':param name: Token
            :param value: Expr.Literal
         '''
-        if name.lexeme in self.values.keys():
-            self.define(name.lexeme, value)
-            return
-        if self.enclosing != None:
-            self.enclosing.assign(name, value)
-            return
-        raise RuntimeException(name, f'Undefined variable {name.lexeme}.')
+        cell = self.cells.get(name.lexeme, None)
+        if cell == None:
+            raise RuntimeException(
+                name, f'Undefined variable {name.lexeme}.')
+        cell.value = value
+        return cell
 
     def get(self, name):
-        if name.lexeme in self.values.keys():
-            return self.values[name.lexeme]
-        if self.enclosing != None:
-            return self.enclosing.get(name)
-        raise RuntimeException(name, f'Undefined name {name.lexeme}.')
+        return self.cell(name).value
+
+class EnvironmentPool:
+    '''Recycles the `Environment`s of scopes which have been left.
+
+    Closures capture the `Cell`s of the variables they use, never an
+    `Environment`. So once its block or call is over, nothing can reach an
+    environment, and it can be reused for the next scope of the same size,
+    instead of allocating a new one.
+    '''
+    def __init__(self):
+        # Size -> (environments free for reuse, values to reset them to).
+        self.free = {}
+        # How many environments had to be allocated, and how many times one
+        # was reused instead.
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, enclosing, size):
+        pool = self.free.get(size, None)
+        if pool == None:
+            pool = self.free[size] = ([], (None,) * size)
+        elif pool[0]:
+            self.reused += 1
+            environment = pool[0].pop()
+            environment.enclosing = enclosing
+            return environment
+        self.allocated += 1
+        return Environment(enclosing, size)
 
-    def getat(self, distance, name):
-        return self.ancestor(distance).values[name.lexeme]
+    def release(self, environment):
+        environments, nils = self.free[len(environment.values)]
+        # Nothing the scope held should be kept alive by the pool.
+        environment.values[:] = nils
+        environment.enclosing = None
+        environments.append(environment)
 
-    def assignat(self, distance, name, value):
-        self.ancestor(distance).values[name] = value
+    def __str__(self):
+        return (f'Environments: {self.allocated} allocated, '
+                f'{self.reused} reused')
@@ -1,12 +1,32 @@
-from lox.environment import Environment
+import operator
+import sys
+import weakref
+
+from lox import Expr
+from lox.environment import Cell, Environment, GlobalEnvironment
 from lox.exceptions import RuntimeException
 from lox.LoxCallable import LoxCallable
-from lox.LoxFunction import LoxFunction
+from lox.LoxFunction import LoxFunction, TailCall, capture
+from lox.memo import Memo
 from lox.native_functions import Clock
-from lox.loxreturn import Return
-from lox.tokentype import TokenType
+from lox.tokentype import (BANG, BANG_EQUAL, EQUAL_EQUAL, GREATER,
+    GREATER_EQUAL, LESS, LESS_EQUAL, MINUS, OR, PLUS, SLASH, STAR)
 from lox.visitor import Visitor
 
+# The operators of the specialized `Expr.FloatArithmetic` and
+# `Expr.FloatCompare` nodes.
+ARITHMETIC_OPERATORS = {
+    MINUS: operator.sub,
+    STAR: operator.mul,
+    SLASH: operator.truediv,
+}
+COMPARISON_OPERATORS = {
+    GREATER: operator.gt,
+    GREATER_EQUAL: operator.ge,
+    LESS: operator.lt,
+    LESS_EQUAL: operator.le,
+}
+
 def _is_true(obj):
     '''Only `nil` and `false` are false. Everything else _evaluates to true.
     '''
@@ -21,6 +41,32 @@ def _check_num_operand(op, *numbers):
         if not isinstance(num, float):
             raise RuntimeException(op, 'Operand must be a number.')
 
+def _check_call(expr, callee, arguments):
+    '''Raise the runtime error for calling `callee` at the call site `expr`,
+    if it can't be called with `arguments`.
+    '''
+    # callee - what would be the type of callee?
+    if not isinstance(callee, LoxCallable):
+        raise RuntimeException(
+    expr.paren, "Can only call functions and classes.")
+
+    # The original author, while writing this compiler in Java typecasted
+    # the callee to LoxCallable, even after checking `isinstance(callee,
+    # LoxCallable`. It isn't clear why. But, I'm apprehensive that this was
+    # to satisfy some weird Inheritance rules of Java.
+
+    # Since there is no explicit type casting mechanism in Python, (or there
+    # is, and I'm not aware of it.) I will assume that the `isinstance`
+    # check is enough and won't do the check.
+
+    # The following line is commented out for documentation reasons.
+    # function = LoxCallable(callee)
+
+    if len(arguments) != callee.arity:
+        raise RuntimeException(
+    expr.paren,
+    f"Expected {callee.arity} arguments, but got {len(arguments)}.")
+
 def stringify(obj):
     if obj == None:
         return 'nil'
@@ -35,13 +81,24 @@ class Interpreter(Visitor):
     # self.environment points towards the current environment, whereas
     # `global_env` always points to the outermost environment.
     # However, due to the implementation, it is shared amongst all instances.
-    global_env = Environment()
+    global_env = GlobalEnvironment()
+    # An `EnvironmentPool` to recycle the environments of blocks and calls,
+    # or `None` to allocate a new one every time.
+    pool = None
+    # Whether the calls of pure functions are memoized, and how many results
+    # are kept for each.
+    memoize = True
+    memo_size = 1024
+
+    # Executing a statement returns `None`, or a one element tuple holding the
+    # returned value once a `return` statement was executed. Blocks, `if` and
+    # loops pass that on, up to the function body.
 
     def __init__(self, lox):
         self.lox = lox
         self.global_env.define("clock", Clock())
         self.environment = self.global_env
-        self.locals = {}
+        self.memos = []
 
     def _execute(self, stmt):
         return self.visit(stmt)
@@ -50,10 +107,15 @@ class Interpreter(Visitor):
         return self.visit(expr)
 
     def _lookup_variable(self, name, expr):
-        distance = self.locals.get(expr, None)
-        if distance != None:
-            return self.environment.getat(distance, name)
-        return self.global_env.get(name)
+        if expr.depth == None:
+            binding = expr.binding
+            if binding is None:
+                binding = expr.binding = self.global_env.cell(name)
+            return binding.value
+        value = self.environment.getat(expr.depth, expr.slot)
+        if expr.cell:
+            return value.value
+        return value
 
     def interpret(self, statements):
         try:
@@ -62,9 +124,6 @@ class Interpreter(Visitor):
         except RuntimeException as err:
             self.lox.runtime_error(err)
 
-    def resolve(self, expr, depth):
-        self.locals[expr] = depth
-
     def visit_LiteralExpr(self, expr):
         return expr.value
 
@@ -74,68 +133,153 @@ class Interpreter(Visitor):
     def visit_UnaryExpr(self, expr):
         right = self._evaluate(expr.right)
 
-        if expr.operator.tokentype == TokenType.MINUS:
+        if expr.operator.tokentype == MINUS:
             _check_num_operand(expr.operator, right)
             return -float(right)
-        elif expr.operator.tokentype == TokenType.BANG:
+        elif expr.operator.tokentype == BANG:
             return not _is_true(right)
         return
 
     def visit_BinaryExpr(self, expr):
         left = self._evaluate(expr.left)
         right = self._evaluate(expr.right)
+        if expr.__class__ is Expr.Binary:
+            self._specialize(expr, left, right)
+        return self._binary(expr, left, right)
 
-        if expr.operator.tokentype == TokenType.PLUS:
+    def _binary(self, expr, left, right):
+        if expr.operator.tokentype == PLUS:
             # This handles both the cases - when (left, right) are float or str
             try:
                 return left + right
             except TypeError:
                 raise RuntimeException(
             expr.operator, 'Operands must be two numbers or two strings.')
-        elif expr.operator.tokentype == TokenType.MINUS:
+        elif expr.operator.tokentype == MINUS:
             _check_num_operand(expr.operator, left, right)
             return left - right
-        elif expr.operator.tokentype == TokenType.STAR:
+        elif expr.operator.tokentype == STAR:
             _check_num_operand(expr.operator, left, right)
             return left * right
-        elif expr.operator.tokentype == TokenType.SLASH:
+        elif expr.operator.tokentype == SLASH:
             _check_num_operand(expr.operator, left, right)
             if right == 0:
                 raise RuntimeException(expr.operator, "Cannot divide by zero.")
             return left / right
-        elif expr.operator.tokentype == TokenType.GREATER:
+        elif expr.operator.tokentype == GREATER:
             _check_num_operand(expr.operator, left, right)
             return left > right
-        elif expr.operator.tokentype == TokenType.GREATER_EQUAL:
+        elif expr.operator.tokentype == GREATER_EQUAL:
             _check_num_operand(expr.operator, left, right)
             return left >= right
-        elif expr.operator.tokentype == TokenType.LESS:
+        elif expr.operator.tokentype == LESS:
             _check_num_operand(expr.operator, left, right)
             return left < right
-        elif expr.operator.tokentype == TokenType.LESS_EQUAL:
+        elif expr.operator.tokentype == LESS_EQUAL:
             _check_num_operand(expr.operator, left, right)
             return left <= right
-        elif expr.operator.tokentype == TokenType.BANG_EQUAL:
+        elif expr.operator.tokentype == BANG_EQUAL:
             return left != right
-        elif expr.operator.tokentype == TokenType.EQUAL_EQUAL:
+        elif expr.operator.tokentype == EQUAL_EQUAL:
             return left == right
         return
 
+    def _specialize(self, expr, left, right):
+        '''Rewrite `expr` into a variant of `Expr.Binary` for the types of
+        `left` and `right`.
+
+        The variants skip the checks on the operator and the operand types of
+        the generic node. Each still guards on the types, and turns into an
+        `Expr.GenericBinary` once they change.
+        '''
+        tokentype = expr.operator.tokentype
+        if type(left) is float and type(right) is float:
+            if tokentype == PLUS:
+                expr.__class__ = Expr.FloatAdd
+                return
+            elif tokentype in ARITHMETIC_OPERATORS:
+                expr.function = ARITHMETIC_OPERATORS[tokentype]
+                expr.__class__ = Expr.FloatArithmetic
+                return
+            elif tokentype in COMPARISON_OPERATORS:
+                expr.function = COMPARISON_OPERATORS[tokentype]
+                local = expr.left
+                if (local.__class__ is Expr.Variable and local.depth == 0 and
+                        not local.cell and
+                        expr.right.__class__ is Expr.Literal):
+                    expr.slot = local.slot
+                    expr.constant = right
+                    expr.__class__ = Expr.LocalCompare
+                else:
+                    expr.__class__ = Expr.FloatCompare
+                return
+        elif (type(left) is str and type(right) is str and
+                tokentype == PLUS):
+            expr.__class__ = Expr.StringConcat
+            return
+        expr.__class__ = Expr.GenericBinary
+
+    def _deoptimize(self, expr, left, right):
+        expr.__class__ = Expr.GenericBinary
+        return self._binary(expr, left, right)
+
+    def visit_FloatAddExpr(self, expr):
+        left = self._evaluate(expr.left)
+        right = self._evaluate(expr.right)
+        if type(left) is float and type(right) is float:
+            return left + right
+        return self._deoptimize(expr, left, right)
+
+    def visit_StringConcatExpr(self, expr):
+        left = self._evaluate(expr.left)
+        right = self._evaluate(expr.right)
+        if type(left) is str and type(right) is str:
+            return left + right
+        return self._deoptimize(expr, left, right)
+
+    def visit_FloatArithmeticExpr(self, expr):
+        left = self._evaluate(expr.left)
+        right = self._evaluate(expr.right)
+        # Dividing by zero is left to the generic node to report.
+        if type(left) is float and type(right) is float and right != 0:
+            return expr.function(left, right)
+        return self._deoptimize(expr, left, right)
+
+    def visit_FloatCompareExpr(self, expr):
+        left = self._evaluate(expr.left)
+        right = self._evaluate(expr.right)
+        if type(left) is float and type(right) is float:
+            return expr.function(left, right)
+        return self._deoptimize(expr, left, right)
+
+    def visit_LocalCompareExpr(self, expr):
+        left = self.environment.values[expr.slot]
+        if type(left) is float:
+            return expr.function(left, expr.constant)
+        return self._deoptimize(expr, left, expr.constant)
+
     def visit_VariableExpr(self, expr):
         return self._lookup_variable(expr.name, expr)
 
     def visit_AssignExpr(self, expr):
         value = self._evaluate(expr.value)
-        distance = self.locals.get(expr, None)
-        if distance != None:
-            self.environment.assignat(distance, expr.name, value)
-        else:
-            self.global_env.assign(expr.name, value)
+        self._assign(expr, value)
         return value
 
+    def _assign(self, expr, value):
+        if expr.depth == None:
+            if expr.binding is None:
+                expr.binding = self.global_env.assign(expr.name, value)
+            else:
+                expr.binding.value = value
+        elif expr.cell:
+            self.environment.getat(expr.depth, expr.slot).value = value
+        else:
+            self.environment.assignat(expr.depth, expr.slot, value)
+
     def visit_LogicalExpr(self, expr):
         left = self._evaluate(expr.left)
-        if expr.operator.tokentype == TokenType.OR:
+        if expr.operator.tokentype == OR:
             if _is_true(left):
                 return left
         else: # AND
@@ -145,31 +289,14 @@ class Interpreter(Visitor):
 
     def visit_CallExpr(self, expr):
         callee = self._evaluate(expr.callee)
-        arguments = []
-        for argument in expr.arguments:
-            arguments.append(self._evaluate(argument))
-        # callee - what would be the type of callee?
-        if not isinstance(callee, LoxCallable):
-            raise RuntimeException(
-    expr.paren, "Can only call functions and classes.")
-
-        # The original author, while writing this compiler in Java typecasted
-        # the callee to LoxCallable, even after checking `isinstance(callee,
-        # LoxCallable`. It isn't clear why. But, I'm apprehensive that this was
-        # to satisfy some weird Inheritance rules of Java.
-
-        # Since there is no explicit type casting mechanism in Python, (or there
-        # is, and I'm not aware of it.) I will assume that the `isinstance`
-        # check is enough and won't do the check.
-
-        # The following line is commented out for documentation reasons.
-        # function = LoxCallable(callee)
-
-        if len(arguments) != callee.arity:
-            raise RuntimeException(
-    expr.paren,
-    f"Expected {function.arity} arguments, but got {len(arguments)}.")
-        return callee.__call__(self, arguments)
+        arguments = [self._evaluate(argument) for argument in expr.arguments]
+        checked = expr.checked_callee
+        if checked is None or checked() is not callee:
+            _check_call(expr, callee, arguments)
+            expr.checked_callee = weakref.ref(callee)
+        if expr.tail and isinstance(callee, LoxFunction):
+            return TailCall(callee, arguments)
+        return callee(self, arguments)
 
     def visit_ExpressionStmt(self, stmt):
         self._evaluate(stmt.expression)
@@ -181,36 +308,92 @@ class Interpreter(Visitor):
         value = None
         if stmt.initializer != None:
             value = self._evaluate(stmt.initializer)
-        self.environment.define(stmt.name.lexeme, value)
+        self._define(stmt, stmt.name, value)
+
+    def _define(self, declaration, name, value):
+        if declaration.slot == None:
+            self.global_env.define(name.lexeme, value)
+        elif declaration.cell:
+            self.environment.values[declaration.slot] = Cell(value)
+        else:
+            self.environment.values[declaration.slot] = value
 
     def _execute_block(self, statements, environment):
         previous = self.environment
         try:
             self.environment = environment
             for statement in statements:
-                self._execute(statement)
+                completion = self._execute(statement)
+                if completion is not None:
+                    return completion
         finally:
             self.environment = previous
 
+    def _execute_body(self, declaration, environment):
+        '''Run the body of the function `declaration` in `environment`, and
+        return what the function returns.
+        '''
+        completion = self._execute_block(declaration.body, environment)
+        if completion is not None:
+            return completion[0]
+
     def visit_BlockStmt(self, stmt):
-        self._execute_block(stmt.statements, Environment(self.environment))
+        if stmt.size == 0:
+            for statement in stmt.statements:
+                completion = self._execute(statement)
+                if completion is not None:
+                    return completion
+            return
+        pool = self.pool
+        if pool == None:
+            return self._execute_block(
+                stmt.statements, Environment(self.environment, stmt.size))
+        environment = pool.acquire(self.environment, stmt.size)
+        completion = self._execute_block(stmt.statements, environment)
+        pool.release(environment)
+        return completion
 
     def visit_IfStmt(self, stmt):
         if _is_true(self._evaluate(stmt.condition)):
-            self._execute(stmt.then_branch)
+            return self._execute(stmt.then_branch)
         elif stmt.else_branch != None:
-            self._execute(stmt.else_branch)
+            return self._execute(stmt.else_branch)
 
     def visit_WhileStmt(self, stmt):
         while _is_true(self._evaluate(stmt.condition)):
-            self._execute(stmt.body)
+            completion = self._execute(stmt.body)
+            if completion is not None:
+                return completion
 
     def visit_FunctionStmt(self, stmt):
-        function = LoxFunction(stmt, self.environment)
-        self.environment.define(stmt.name.lexeme, function)
+        if stmt.cell:
+            # The function captures itself, so its cell has to exist first.
+            cell = self.environment.values[stmt.slot] = Cell(None)
+            cell.value = LoxFunction(
+                stmt, capture(stmt, self.environment), self._memo(stmt))
+            return
+        function = LoxFunction(
+            stmt, capture(stmt, self.environment), self._memo(stmt))
+        self._define(stmt, stmt.name, function)
+
+    def _memo(self, declaration):
+        '''The `Memo` for the calls of the functions `declaration` declares,
+        or `None` if they aren't memoized.
+        '''
+        if not (self.memoize and declaration.pure):
+            return None
+        if declaration.memo == None:
+            declaration.memo = Memo(
+                declaration, self.global_env, self.memo_size)
+            self.memos.append(declaration.memo)
+        return declaration.memo
+
+    def report_memos(self):
+        for memo in self.memos:
+            print(memo, file=sys.stderr)
 
     def visit_ReturnStmt(self, stmt):
         value = stmt.value
         if value != None:
             value = self._evaluate(stmt.value)
-        raise Return(value)
+        return (value,)
@@ -1,17 +1,59 @@
+import argparse
+import atexit
 import sys
 
+from lox.closure_compiler import ClosureInterpreter
+from lox.environment import EnvironmentPool
 from lox.interpreter import Interpreter
 from lox.parser import Parser
+from lox.optimizer import Optimizer
 from lox.resolver import Resolver
 from lox.scanner import Scanner
-from lox.tokentype import TokenType
+from lox.stackless import StacklessInterpreter
+from lox.tiered import TieredInterpreter
+from lox.tokentype import EOF
+from lox.transpiler import PythonInterpreter
+from lox.vm import VM
+
+# Execution engines, selectable with `Lox(engine=...)`.
+ENGINES = {
+    'tree': Interpreter,
+    'closure': ClosureInterpreter,
+    'vm': VM,
+    'python': PythonInterpreter,
+    'stackless': StacklessInterpreter,
+    'tiered': TieredInterpreter,
+}
+
+# Engines which walk the syntax tree, and can recycle environments.
+POOLING_ENGINES = ('stackless', 'tiered', 'tree')
+# Engines which memoize the calls of pure functions.
+MEMOIZING_ENGINES = ('closure', 'tiered', 'tree')
 
 class Lox:
-    def __init__(self):
+    def __init__(self, engine='tree', show_optimizations=False,
+                 pool_environments=False, memoize=True, stream_tokens=True,
+                 compact_tokens=False, max_nesting=None):
         self.had_error = False
         self.had_runtime_error = False
-        self.interpreter = Interpreter(self)
-        self.resolver = Resolver(self, self.interpreter)
+        self.interpreter = ENGINES[engine](self)
+        if pool_environments:
+            self.interpreter.pool = EnvironmentPool()
+        if not memoize:
+            self.interpreter.memoize = False
+        self.resolver = Resolver(self)
+        self.optimizer = Optimizer()
+        # Print what the optimizer changed, to stderr.
+        self.show_optimizations = show_optimizations
+        # Scan tokens as the parser asks for them, rather than all of them
+        # before parsing starts.
+        self.stream_tokens = stream_tokens
+        # Scan all the tokens into a `TokenArray` before parsing, which takes
+        # far less memory than a list of them.
+        self.compact_tokens = compact_tokens
+        # How deeply statements and expressions can nest, `Parser.max_depth`
+        # by default.
+        self.max_nesting = max_nesting
 
     def _report(self, line, where, message):
         # Should we pipe to `sys.stderr`?
@@ -19,7 +61,7 @@ class Lox:
 
     def error(self, token, message):
         self.had_error = True
-        if token.tokentype == TokenType.EOF:
+        if token.tokentype == EOF:
             self._report(token.line, " at end", message)
         else:
             self._report(token.line, f" at '{token.lexeme}'", message)
@@ -47,22 +89,116 @@ class Lox:
 
     def run(self, source):
         scanner = Scanner(source, self)
-        tokens = scanner.scan_tokens()
-        statements = Parser(tokens, self).parse()
+        if self.compact_tokens:
+            tokens = scanner.scan_compact()
+        elif self.stream_tokens:
+            tokens = scanner.scan()
+        else:
+            tokens = scanner.scan_tokens()
+        parser = Parser(tokens, self, self.max_nesting)
+        statements = parser.parse()
         if self.had_error:
             return
-        resolver = self.resolver.resolve(statements)
-        if self.had_error:
+        try:
+            self.resolver.resolve(statements)
+            if self.had_error:
+                return
+            statements = self.optimizer.optimize(statements)
+            if self.show_optimizations:
+                for optimization in self.optimizer.optimizations:
+                    print(optimization, file=sys.stderr)
+            if self.optimizer.hoisted:
+                self.resolver.resolve(statements)
+        except RecursionError:
+            # The resolver and the optimizer run no Lox code, but recurse in
+            # Python for every level of the tree: nesting deeper than the
+            # default `Parser.max_depth`, which `max_nesting` allows, or a
+            # long chain of operators, each the left operand of the next.
+            self.error(parser.deepest, 'Too deeply nested.')
             return
         self.interpreter.interpret(statements)
 
 def main():
-    l = Lox()
-    if len(sys.argv) > 2:
-        print("Usage: lox {script}")
-        sys.exit(64)
-    elif len(sys.argv) == 2:
-        l.run_file(sys.argv[1])
+    parser = argparse.ArgumentParser(prog='plox')
+    parser.add_argument('script', nargs='?')
+    parser.add_argument(
+        '--engine', choices=sorted(ENGINES),
+        help='how to execute the program (default: tree)')
+    parser.add_argument(
+        '--dump-python', action='store_true',
+        help='print the Python source generated by the python engine')
+    parser.add_argument(
+        '--show-optimizations', action='store_true',
+        help='print what the optimizer changed in the program')
+    parser.add_argument(
+        '--max-depth', type=int,
+        help='depth of Lox calls at which the stackless engine reports a '
+             'stack overflow')
+    parser.add_argument(
+        '--max-nesting', type=int,
+        help='how deeply statements and expressions can nest, before it is '
+             'reported as an error')
+    parser.add_argument(
+        '--tier-threshold', type=int,
+        help='calls or loop iterations before the tiered engine compiles a '
+             'function or loop')
+    parser.add_argument(
+        '--tier-stats', action='store_true',
+        help='report what the tiered engine compiled, and when')
+    parser.add_argument(
+        '--pool-environments', action='store_true',
+        help='recycle the environments of blocks and calls, and report how '
+             'many were allocated')
+    parser.add_argument(
+        '--no-memoize', action='store_true',
+        help='call pure functions every time, instead of reusing the result '
+             'of an earlier call with the same arguments')
+    parser.add_argument(
+        '--memo-stats', action='store_true',
+        help='report how often the result of a pure function was reused')
+    args = parser.parse_args()
+
+    # Flags which only one engine understands pick that engine, unless
+    # another one was asked for.
+    engine_flags = [
+        (args.dump_python, '--dump-python needs', 'python'),
+        (args.max_depth != None, '--max-depth needs', 'stackless'),
+        (args.tier_threshold != None or args.tier_stats,
+         '--tier-threshold and --tier-stats need', 'tiered'),
+    ]
+    engine = args.engine
+    for given, flags, needed in engine_flags:
+        if given:
+            if engine not in (None, needed):
+                parser.error(f'{flags} the {needed} engine')
+            engine = needed
+    if engine == None:
+        engine = 'tree'
+    if args.pool_environments and engine not in POOLING_ENGINES:
+        parser.error(
+            f'--pool-environments needs one of the engines: '
+            f'{", ".join(POOLING_ENGINES)}')
+    if args.memo_stats and engine not in MEMOIZING_ENGINES:
+        parser.error(
+            f'--memo-stats needs one of the engines: '
+            f'{", ".join(MEMOIZING_ENGINES)}')
+    l = Lox(engine=engine, show_optimizations=args.show_optimizations,
+            pool_environments=args.pool_environments,
+            memoize=not args.no_memoize, max_nesting=args.max_nesting)
+    if args.dump_python:
+        l.interpreter.dump_source = True
+    if args.max_depth != None:
+        l.interpreter.max_depth = args.max_depth
+    if args.tier_threshold != None:
+        l.interpreter.threshold = args.tier_threshold
+    if args.tier_stats:
+        atexit.register(l.interpreter.report)
+    if args.pool_environments:
+        atexit.register(print, l.interpreter.pool, file=sys.stderr)
+    if args.memo_stats:
+        atexit.register(l.interpreter.report_memos)
+    if args.script != None:
+        l.run_file(args.script)
     else:
         l.run_prompt()
 
@@ -1,4 +0,0 @@
-class Return(Exception):
-    def __init__(self, value, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.value = value
@@ -0,0 +1,94 @@
+'''Memoize the calls of pure Lox functions.
+
+The `Resolver` marks a `Stmt.Function` as pure when its result only depends
+on its arguments, and on the globals it reads. A `Memo` keeps the results of
+the calls of such a function, for as long as those globals don't change.
+'''
+from collections import OrderedDict
+
+from lox.LoxCallable import LoxCallable
+from lox.LoxFunction import LoxFunction
+
+class Memo:
+    '''The results of the calls of the function `declaration`, by argument
+    values. Only the `size` most recently used are kept.
+
+    Every function declared by a pure declaration behaves the same, as none
+    has free variables, so they all share one memo.
+    '''
+    def __init__(self, declaration, global_env, size):
+        self.declaration = declaration
+        self.global_env = global_env
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # `(cell, value)` for every global the results depend on, directly or
+        # through the functions called, or `None` if one isn't defined yet.
+        self.dependencies = None
+        self.usable = False
+        # Set once the memo turned out not to pay off.
+        self.abandoned = False
+
+    @staticmethod
+    def key(arguments):
+        # Python considers `1.0 == True` and `0.0 == -0.0`, Lox arguments
+        # don't, like the constants of `FunctionCompiler.make_constant`.
+        return (*arguments, *map(type, arguments), *map(str, arguments))
+
+    def valid(self):
+        '''Whether the kept results can be used, and new ones kept.'''
+        if self.abandoned:
+            return False
+        dependencies = self.dependencies
+        if dependencies != None:
+            for cell, value in dependencies:
+                if cell.value is not value:
+                    break
+            else:
+                return self.usable
+        self.results.clear()
+        self._depend()
+        return self.usable
+
+    def _depend(self):
+        self.dependencies = []
+        self.usable = True
+        declarations = [self.declaration]
+        seen = {self.declaration}
+        while declarations:
+            for name in declarations.pop().globals:
+                cell = self.global_env.cells.get(name, None)
+                if cell == None:
+                    self.dependencies = None
+                    self.usable = False
+                    return
+                value = cell.value
+                self.dependencies.append((cell, value))
+                if isinstance(value, LoxFunction):
+                    if not value.declaration.pure:
+                        self.usable = False
+                    elif value.declaration not in seen:
+                        seen.add(value.declaration)
+                        declarations.append(value.declaration)
+                elif isinstance(value, LoxCallable):
+                    # A native function, like `clock`.
+                    self.usable = False
+
+    def store(self, key, result):
+        if self.abandoned:
+            return
+        results = self.results
+        results[key] = result
+        if len(results) > self.size:
+            results.popitem(last=False)
+            # Calls which are hardly ever repeated only pay for the lookups.
+            if self.hits * 4 < self.misses:
+                self.abandoned = True
+                results.clear()
+
+    def __str__(self):
+        name = self.declaration.name
+        abandoned = ', abandoned' if self.abandoned else ''
+        return (f'[Line {name.line}] Memoized {name.lexeme}: '
+                f'{self.hits} hits, {self.misses} misses{abandoned}')
@@ -0,0 +1,315 @@
+'''Rewrite resolved programs before they are interpreted.
+
+`Optimizer` folds operators over literal operands, removes `if` branches and
+`while` loops whose condition is a constant, and hoists the invariant parts of
+`while` conditions out of the loop. Every engine runs the optimized tree, so
+Lox semantics are kept exactly: nothing which could raise a runtime error is
+folded, and an error in a hoisted expression is raised where the first check
+of the condition would have raised it.
+'''
+import functools
+import operator
+
+from lox import Expr, Stmt
+from lox.ast_printer import ASTPrinter
+from lox.interpreter import _is_true, stringify
+from lox.token import Token
+from lox.tokentype import (BANG, BANG_EQUAL, EQUAL_EQUAL, GREATER,
+    GREATER_EQUAL, IDENTIFIER, LESS, LESS_EQUAL, MINUS, OR, PLUS, SLASH, STAR)
+from lox.visitor import Visitor
+
+# Binary operators which only accept two numbers, and never fail then.
+NUMERIC_OPERATORS = {
+    MINUS: operator.sub,
+    STAR: operator.mul,
+    GREATER: operator.gt,
+    GREATER_EQUAL: operator.ge,
+    LESS: operator.lt,
+    LESS_EQUAL: operator.le,
+}
+
+class Optimization:
+    def __init__(self, line, description):
+        self.line = line
+        self.description = description
+
+    def __str__(self):
+        return f'[Line {self.line}] {self.description}'
+
+@functools.cache
+def _fields(nodetype):
+    '''The `__slots__` of `nodetype`, and of the classes it derives from.'''
+    return [field for cls in nodetype.__mro__
+            for field in getattr(cls, '__slots__', ())]
+
+def _nodes(node):
+    '''`node` and every `Expr` and `Stmt` below it.'''
+    yield node
+    for field in _fields(type(node)):
+        value = getattr(node, field, None)
+        children = value if isinstance(value, list) else [value]
+        for child in children:
+            if isinstance(child, (Expr.Expr, Stmt.Stmt)):
+                yield from _nodes(child)
+
+def _show(expr):
+    return ASTPrinter().pprint_ast(expr)
+
+class _Hoister:
+    '''Replaces the invariant parts of the condition of `loop` with new
+    variables, declared in `declarations`.
+
+    A part of the condition is invariant when it is pure, and no variable it
+    reads can change while the loop runs. It is only hoisted if everything
+    evaluated before it in the condition is pure and can't fail, so that it
+    fails exactly when the first check of the condition would have.
+    '''
+    def __init__(self, loop):
+        nodes = list(_nodes(loop))
+        self.assigned = {
+            node.name.lexeme for node in nodes
+            if isinstance(node, Expr.Assign)}
+        # Any call could change a global, or a variable held in a `Cell`.
+        self.calls = any(isinstance(node, Expr.Call) for node in nodes)
+        self.declarations = []
+        self.names = {}
+        self.safe = True
+
+    def _invariant(self, expr):
+        for node in _nodes(expr):
+            if isinstance(node, (Expr.Call, Expr.Assign)):
+                return False
+            if isinstance(node, Expr.Variable):
+                if node.name.lexeme in self.assigned:
+                    return False
+                if self.calls and (node.depth == None or node.cell):
+                    return False
+        return True
+
+    def _variable(self, expr):
+        key = _show(expr)
+        name = self.names.get(key, None)
+        if name == None:
+            # The space keeps the name apart from any Lox identifier.
+            name = self.names[key] = Token(
+                IDENTIFIER, f'invariant {len(self.names)}', None,
+                expr.operator.line)
+            self.declarations.append(Stmt.Var(name, expr))
+        return Expr.Variable(name)
+
+    def rewrite(self, expr, conditional=False):
+        '''`conditional` is set for the parts which may not be evaluated.'''
+        if (self.safe and not conditional and
+                isinstance(expr, (Expr.Binary, Expr.Unary, Expr.Logical)) and
+                self._invariant(expr)):
+            return self._variable(expr)
+
+        if isinstance(expr, Expr.Variable):
+            # Globals may be undefined.
+            if expr.depth == None:
+                self.safe = False
+        elif isinstance(expr, Expr.Grouping):
+            expr.expression = self.rewrite(expr.expression, conditional)
+        elif isinstance(expr, Expr.Unary):
+            expr.right = self.rewrite(expr.right, conditional)
+            if expr.operator.tokentype == MINUS:
+                self.safe = False
+        elif isinstance(expr, Expr.Binary):
+            expr.left = self.rewrite(expr.left, conditional)
+            expr.right = self.rewrite(expr.right, conditional)
+            if expr.operator.tokentype not in (EQUAL_EQUAL, BANG_EQUAL):
+                self.safe = False
+        elif isinstance(expr, Expr.Logical):
+            expr.left = self.rewrite(expr.left, conditional)
+            expr.right = self.rewrite(expr.right, True)
+        elif isinstance(expr, Expr.Call):
+            expr.callee = self.rewrite(expr.callee, conditional)
+            expr.arguments = [
+                self.rewrite(argument, conditional)
+                for argument in expr.arguments]
+            self.safe = False
+        elif isinstance(expr, Expr.Assign):
+            expr.value = self.rewrite(expr.value, conditional)
+            self.safe = False
+        return expr
+
+class Optimizer(Visitor):
+    def __init__(self):
+        self.optimizations = []
+        # Whether hoisting declared new variables, which then need resolving.
+        self.hoisted = False
+
+    def optimize(self, statements):
+        self.optimizations = []
+        self.hoisted = False
+        return self._optimize_statements(statements)
+
+    def _optimize(self, expr_or_stmt):
+        return self.visit(expr_or_stmt)
+
+    def _optimize_statements(self, statements):
+        optimized = []
+        for statement in statements:
+            statement = self._optimize(statement)
+            if statement != None:
+                optimized.append(statement)
+        return optimized
+
+    def _optimize_branch(self, stmt):
+        '''Optimize a statement which can't be removed altogether.'''
+        optimized = self._optimize(stmt)
+        if optimized == None:
+            return Stmt.Block([])
+        return optimized
+
+    def _report(self, line, description):
+        self.optimizations.append(Optimization(line, description))
+
+    def _fold(self, expr, value):
+        folded = Expr.Literal(value)
+        self._report(
+            expr.operator.line, f'Folded {_show(expr)} into {_show(folded)}')
+        return folded
+
+    def visit_LiteralExpr(self, expr):
+        return expr
+
+    def visit_VariableExpr(self, expr):
+        return expr
+
+    def visit_GroupingExpr(self, expr):
+        expr.expression = self._optimize(expr.expression)
+        if isinstance(expr.expression, Expr.Literal):
+            return expr.expression
+        return expr
+
+    def visit_UnaryExpr(self, expr):
+        expr.right = self._optimize(expr.right)
+        if not isinstance(expr.right, Expr.Literal):
+            return expr
+        value = expr.right.value
+        if expr.operator.tokentype == BANG:
+            return self._fold(expr, not _is_true(value))
+        if isinstance(value, float):
+            return self._fold(expr, -value)
+        return expr
+
+    def visit_BinaryExpr(self, expr):
+        expr.left = self._optimize(expr.left)
+        expr.right = self._optimize(expr.right)
+        if not (isinstance(expr.left, Expr.Literal) and
+                isinstance(expr.right, Expr.Literal)):
+            return expr
+
+        a = expr.left.value
+        b = expr.right.value
+        tokentype = expr.operator.tokentype
+        numbers = isinstance(a, float) and isinstance(b, float)
+        if tokentype == EQUAL_EQUAL:
+            return self._fold(expr, a == b)
+        elif tokentype == BANG_EQUAL:
+            return self._fold(expr, a != b)
+        elif tokentype == PLUS:
+            if numbers or (isinstance(a, str) and isinstance(b, str)):
+                return self._fold(expr, a + b)
+        elif tokentype == SLASH:
+            # Dividing by zero is a runtime error, left to the interpreter.
+            if numbers and b != 0:
+                return self._fold(expr, a / b)
+        elif numbers:
+            return self._fold(expr, NUMERIC_OPERATORS[tokentype](a, b))
+        return expr
+
+    def visit_LogicalExpr(self, expr):
+        expr.left = self._optimize(expr.left)
+        expr.right = self._optimize(expr.right)
+        if not isinstance(expr.left, Expr.Literal):
+            return expr
+
+        # The result is the left operand if it decides the outcome, and the
+        # right one otherwise.
+        left = _is_true(expr.left.value)
+        if left == (expr.operator.tokentype == OR):
+            result = expr.left
+        else:
+            result = expr.right
+        self._report(
+            expr.operator.line, f'Folded {_show(expr)} into {_show(result)}')
+        return result
+
+    def visit_AssignExpr(self, expr):
+        expr.value = self._optimize(expr.value)
+        return expr
+
+    def visit_CallExpr(self, expr):
+        expr.callee = self._optimize(expr.callee)
+        expr.arguments = [
+            self._optimize(argument) for argument in expr.arguments]
+        return expr
+
+    def visit_ExpressionStmt(self, stmt):
+        stmt.expression = self._optimize(stmt.expression)
+        return stmt
+
+    def visit_PrintStmt(self, stmt):
+        stmt.expression = self._optimize(stmt.expression)
+        return stmt
+
+    def visit_VarStmt(self, stmt):
+        if stmt.initializer != None:
+            stmt.initializer = self._optimize(stmt.initializer)
+        return stmt
+
+    def visit_BlockStmt(self, stmt):
+        stmt.statements = self._optimize_statements(stmt.statements)
+        return stmt
+
+    def visit_IfStmt(self, stmt):
+        stmt.condition = self._optimize(stmt.condition)
+        stmt.then_branch = self._optimize_branch(stmt.then_branch)
+        if stmt.else_branch != None:
+            stmt.else_branch = self._optimize_branch(stmt.else_branch)
+        if not isinstance(stmt.condition, Expr.Literal):
+            return stmt
+
+        condition = stringify(stmt.condition.value)
+        if _is_true(stmt.condition.value):
+            branch, kept = stmt.then_branch, ', keeping its then branch'
+        else:
+            branch, kept = stmt.else_branch, ', keeping its else branch'
+        if branch == None:
+            kept = ''
+        self._report(stmt.keyword.line, f'Removed if ({condition}){kept}')
+        return branch
+
+    def visit_WhileStmt(self, stmt):
+        stmt.condition = self._optimize(stmt.condition)
+        stmt.body = self._optimize_branch(stmt.body)
+        if isinstance(stmt.condition, Expr.Literal):
+            if _is_true(stmt.condition.value):
+                return stmt
+            self._report(
+                stmt.keyword.line,
+                f'Removed {stmt.keyword.lexeme} loop which never runs')
+            return
+
+        hoister = _Hoister(stmt)
+        stmt.condition = hoister.rewrite(stmt.condition)
+        if not hoister.declarations:
+            return stmt
+        for declaration in hoister.declarations:
+            self._report(
+                declaration.name.line,
+                f'Hoisted {_show(declaration.initializer)} out of '
+                f'{stmt.keyword.lexeme} loop')
+        self.hoisted = True
+        return Stmt.Block(hoister.declarations + [stmt])
+
+    def visit_FunctionStmt(self, stmt):
+        stmt.body = self._optimize_statements(stmt.body)
+        return stmt
+
+    def visit_ReturnStmt(self, stmt):
+        if stmt.value != None:
+            stmt.value = self._optimize(stmt.value)
+        return stmt
@@ -1,39 +1,105 @@
+'''Parse tokens into a syntax tree, without recursing in Python.
+
+Statements are parsed by generators: where a statement nests another one, the
+generator parsing it yields a generator parsing the nested statement, and
+`_run` keeps it on an explicit list until the nested statement is parsed.
+Expressions are parsed by a loop, which keeps what waits for the expression
+being parsed on a list. So how deeply the source can nest is limited by
+`max_depth`, which is reported as a Lox parse error, rather than by Python's
+recursion limit.
+'''
 from lox import Expr
 from lox.exceptions import ParseException
 from lox import Stmt
-from lox.tokentype import TokenType
+from lox.tokentype import (AND, BANG, BANG_EQUAL, CLASS, COMMA, ELSE, EOF,
+    EQUAL, EQUAL_EQUAL, FALSE, FOR, FUN, GREATER, GREATER_EQUAL,
+    IDENTIFIER, IF, LEFT_BRACE, LEFT_PAREN, LESS, LESS_EQUAL, MINUS, NIL,
+    NUMBER, OR, PLUS, PRINT, RETURN, RIGHT_BRACE, RIGHT_PAREN, SEMICOLON,
+    SLASH, STAR, STRING, TRUE, VAR, WHILE)
+
+# The precedence of every binary operator, from the loosest binding, and the
+# node it makes.
+BINARY_OPERATORS = {
+    OR: (1, Expr.Logical),
+    AND: (2, Expr.Logical),
+    BANG_EQUAL: (3, Expr.Binary),
+    EQUAL_EQUAL: (3, Expr.Binary),
+    GREATER: (4, Expr.Binary),
+    GREATER_EQUAL: (4, Expr.Binary),
+    LESS: (4, Expr.Binary),
+    LESS_EQUAL: (4, Expr.Binary),
+    MINUS: (5, Expr.Binary),
+    PLUS: (5, Expr.Binary),
+    SLASH: (6, Expr.Binary),
+    STAR: (6, Expr.Binary),
+}
+OR_PRECEDENCE = BINARY_OPERATORS[OR][0]
+# Binds tighter than every binary operator, but not than calls.
+UNARY_PRECEDENCE = 7
+
+CONSTANTS = {
+    FALSE: False,
+    TRUE: True,
+    NIL: None,
+}
+
+# The tokens an operand can start with.
+OPERAND_STARTS = {
+    IDENTIFIER, NUMBER, STRING, MINUS, BANG, LEFT_PAREN, *CONSTANTS}
+
+# What can wait for the expression being parsed, on the stack of
+# `Parser.expression`: a unary or binary operator it is the operand of, or
+# parentheses, a call or an assignment it is a whole expression in.
+UNARY = 0
+BINARY = 1
+GROUPING = 2
+ARGUMENT = 3
+ASSIGNMENT = 4
 
 class Parser:
-    def __init__(self, tokens, lox):
-        self.tokens = tokens
-        self.current = 0
+    # How deeply statements and expressions can nest, before it is reported
+    # as an error. The passes after parsing still recurse in Python for every
+    # level, and every engine gets through 128 of them, with room to spare.
+    max_depth = 128
+
+    def __init__(self, tokens, lox, max_depth=None):
+        '''`tokens` can be a list, or a generator like `Scanner.scan()`:
+        tokens are only taken from it as the parser reaches them, and only the
+        current and previous ones are kept.
+        '''
+        self.tokens = iter(tokens)
+        self._previous = None
+        self._next = next(self.tokens)
         self.lox = lox
+        if max_depth != None:
+            self.max_depth = max_depth
+        # How many statements the one being parsed is nested in.
+        self.depth = 0
+        # The token where statements and expressions nest the deepest, and
+        # how deep that is.
+        self.deepest = None
+        self.deepest_depth = -1
 
     def _check(self, matchtype):
-        if self._at_end():
-            return False
-        return self._peek().tokentype == matchtype
-
-    @property
-    def _previous(self):
-        return self.tokens[self.current - 1]
+        # Never true at the end, as nothing checks for `EOF`.
+        return self._next.tokentype == matchtype
 
     def _peek(self):
-        return self.tokens[self.current]
+        return self._next
 
     def _advance(self):
         if not self._at_end():
-            self.current = self.current + 1
+            self._previous = self._next
+            self._next = next(self.tokens)
         return self._previous
 
     def _at_end(self):
-        return self._peek().tokentype == TokenType.EOF
+        return self._next.tokentype == EOF
 
-    def _match(self, matchtypes):
-        for matchtype in matchtypes:
-            if self._check(matchtype):
-                self._advance()
-                return True
+    def _match(self, matchtype):
+        if self._check(matchtype):
+            self._advance()
+            return True
         return False
 
     def _error(self, token, message):
@@ -45,25 +111,59 @@ class Parser:
             return self._advance()
         raise self._error(self._peek(), message)
 
-    def _finish_call(self, callee):
-        arguments = []
-        if not self._check(TokenType.RIGHT_PAREN):
-            arguments.append(self.expression())
-            while self._match([TokenType.COMMA]):
-                arguments.append(self.expression())
+    def _finish_call(self, callee, arguments):
         paren = self._consume(
-            TokenType.RIGHT_PAREN, "Expected ')' after arguments.")
+            RIGHT_PAREN, "Expected ')' after arguments.")
         if len(arguments) > 255:
             self._error(self._peek(), "Cannot have more than 255 arguments.")
         return Expr.Call(callee, paren, arguments)
 
+    def _run(self, parser):
+        '''Run the generator `parser`, and the generators it yields for the
+        statements nested in it, and return the statement it parsed.
+        '''
+        frames = []
+        statement = None
+        error = None
+        while True:
+            try:
+                if error != None:
+                    error, raised = None, error
+                    nested = parser.throw(raised)
+                else:
+                    nested = parser.send(statement)
+            except StopIteration as stop:
+                statement = stop.value
+                if not frames:
+                    return statement
+                parser = frames.pop()
+                self.depth = len(frames)
+                continue
+            except ParseException as err:
+                if not frames:
+                    raise
+                # Raise it in the statement the nested one is part of.
+                error = err
+                parser = frames.pop()
+                self.depth = len(frames)
+                continue
+            if len(frames) >= self.max_depth:
+                error = self._error(self._peek(), "Too deeply nested.")
+                continue
+            frames.append(parser)
+            self.depth = len(frames)
+            if self.depth > self.deepest_depth:
+                self.deepest, self.deepest_depth = self._peek(), self.depth
+            parser = nested
+            statement = None
+
     def declaration(self):
         try:
-            if self._match([TokenType.VAR]):
+            if self._match(VAR):
                 return self.var_declaration()
-            elif self._match([TokenType.FUN]):
-                return self.function_declaration("function")
-            return self.statement()
+            elif self._match(FUN):
+                return (yield from self.function_declaration("function"))
+            return (yield from self.statement())
         except ParseException:
             self._synchronize()
 
@@ -71,80 +171,87 @@ class Parser:
         '''We reuse this method for both function and method declaration.
            `kind` is used to distinguish between the two.
         '''
-        name = self._consume(TokenType.IDENTIFIER, f"Expect {kind} name.")
-        self._consume(TokenType.LEFT_PAREN, f"Expect '(' after {kind} name.")
+        name = self._consume(IDENTIFIER, f"Expect {kind} name.")
+        self._consume(LEFT_PAREN, f"Expect '(' after {kind} name.")
         parameters = []
-        if not self._check(TokenType.RIGHT_PAREN):
+        if not self._check(RIGHT_PAREN):
             parameters.append(self._consume(
-                TokenType.IDENTIFIER, "Expect parameter name."))
-            while self._match([TokenType.COMMA]):
+                IDENTIFIER, "Expect parameter name."))
+            while self._match(COMMA):
                 parameters.append(self._consume(
-                    TokenType.IDENTIFIER, "Expect parameter name."))
+                    IDENTIFIER, "Expect parameter name."))
         if len(parameters) > 255:
             self._error(self._peek(), "Cannot have more than 255 parameters.")
-        self._consume(TokenType.RIGHT_PAREN, "Expect ')'after parameters.")
+        self._consume(RIGHT_PAREN, "Expect ')'after parameters.")
         self._consume(
-            TokenType.LEFT_BRACE, "Expect '{' before" + kind + "body.")
-        body = self.block()
+            LEFT_BRACE, "Expect '{' before" + kind + "body.")
+        body = yield from self.block()
         return Stmt.Function(name, parameters, body)
 
     def var_declaration(self):
-        name = self._consume(TokenType.IDENTIFIER, "Expect variable name.")
-        value = self.expression() if self._match([TokenType.EQUAL]) else None
+        name = self._consume(IDENTIFIER, "Expect variable name.")
+        value = self.expression() if self._match(EQUAL) else None
         self._consume(
-            TokenType.SEMICOLON, "Expect ';' after variable declaration.")
+            SEMICOLON, "Expect ';' after variable declaration.")
         return Stmt.Var(name, value)
 
     def statement(self):
-        if self._match([TokenType.FOR]):
-            return self.for_statement()
-        if self._match([TokenType.IF]):
-            return self.if_statement()
-        if self._match([TokenType.PRINT]):
+        if self._match(FOR):
+            return (yield from self.for_statement())
+        if self._match(IF):
+            return (yield from self.if_statement())
+        if self._match(PRINT):
             return self.print_statement()
-        if self._match([TokenType.RETURN]):
+        if self._match(RETURN):
             return self.return_statement()
-        if self._match([TokenType.WHILE]):
-            return self.while_statement()
-        if self._match([TokenType.LEFT_BRACE]):
-            return Stmt.Block(self.block())
+        if self._match(WHILE):
+            return (yield from self.while_statement())
+        if self._match(LEFT_BRACE):
+            return Stmt.Block((yield from self.block()))
         return self.expression_statement()
 
     def block(self):
         statements = []
-        while (not self._check(TokenType.RIGHT_BRACE)) and (not self._at_end()):
-            statements.append(self.declaration())
-        self._consume(TokenType.RIGHT_BRACE, "Expect '}' after block.")
+        while (not self._check(RIGHT_BRACE)) and (not self._at_end()):
+            statements.append((yield self.declaration()))
+        self._consume(RIGHT_BRACE, "Expect '}' after block.")
         return statements
 
     def return_statement(self):
         keyword = self._previous
         value = None
-        if not self._check(TokenType.SEMICOLON):
+        if not self._check(SEMICOLON):
             value = self.expression()
-        self._consume(TokenType.SEMICOLON, "Expect ';' after return value.")
+        self._consume(SEMICOLON, "Expect ';' after return value.")
         return Stmt.Return(keyword, value)
 
     def for_statement(self):
-        self._consume(TokenType.LEFT_PAREN, "Expect '(' after 'for'.")
+        keyword = self._previous
+        self._consume(LEFT_PAREN, "Expect '(' after 'for'.")
 
-        if self._match([TokenType.SEMICOLON]):
+        if self._match(SEMICOLON):
             initializer = None
-        elif self._match([TokenType.VAR]):
+        elif self._match(VAR):
             initializer = self.var_declaration()
         else:
             initializer = self.expression()
 
         condition = Expr.Literal(True)
-        if not self._check(TokenType.SEMICOLON):
+        if not self._check(SEMICOLON):
             condition = self.expression()
-        self._consume(TokenType.SEMICOLON, "Expect ';' after loop condition.")
+        self._consume(SEMICOLON, "Expect ';' after loop condition.")
 
         incrementor = None
-        if not self._check(TokenType.RIGHT_PAREN):
+        if not self._check(RIGHT_PAREN):
             incrementor = self.expression()
-        self._consume(TokenType.RIGHT_PAREN, "Expect ') after for clauses.")
+        self._consume(RIGHT_PAREN, "Expect ') after for clauses.")
+        # The body ends up nested deeper than that of a `while`, in the
+        # blocks which hold the initializer and the incrementor. The passes
+        # after parsing recurse through those as well, so they count.
         body = self.statement()
+        for _ in range((initializer != None) + (incrementor != None)):
+            body = self._nested(body)
+        body = yield body
 
         # Lox Code - `for (var a = 0; a < 3; a = a + 1) print a;`
         # is ~transalated~ desugared into:
@@ -157,155 +264,173 @@ class Parser:
         # }
 
         if incrementor != None:
-            body = Stmt.Block([body, incrementor])
-        body = Stmt.While(condition, body)
+            body = Stmt.Block([body, Stmt.Expression(incrementor)])
+        body = Stmt.While(keyword, condition, body)
         if initializer != None:
             body = Stmt.Block([initializer, body])
 
         return body
 
+    def _nested(self, parser):
+        '''Run `parser` one statement deeper than it would be.'''
+        return (yield parser)
+
     def while_statement(self):
-        self._consume(TokenType.LEFT_PAREN, "Expect ')' after while.")
+        keyword = self._previous
+        self._consume(LEFT_PAREN, "Expect ')' after while.")
         condition = self.expression()
-        self._consume(TokenType.RIGHT_PAREN, "Expect ')' after condition.")
-        body = self.statement()
-        return Stmt.While(condition, body)
+        self._consume(RIGHT_PAREN, "Expect ')' after condition.")
+        body = yield self.statement()
+        return Stmt.While(keyword, condition, body)
 
     def if_statement(self):
-        self._consume(TokenType.LEFT_PAREN, "Expect '(' after 'if'.")
+        keyword = self._previous
+        self._consume(LEFT_PAREN, "Expect '(' after 'if'.")
         condition = self.expression()
-        self._consume(TokenType.RIGHT_PAREN, "Expect ')' after if condition.")
+        self._consume(RIGHT_PAREN, "Expect ')' after if condition.")
 
-        then_branch = self.statement()
+        then_branch = yield self.statement()
         else_branch = None
-        if self._match([TokenType.ELSE]):
-            else_branch = self.statement()
+        if self._match(ELSE):
+            else_branch = yield self.statement()
 
-        return Stmt.If(condition, then_branch, else_branch)
+        return Stmt.If(keyword, condition, then_branch, else_branch)
 
     def print_statement(self):
         value = self.expression()
-        self._consume(TokenType.SEMICOLON, "Expected ';' after expression.")
+        self._consume(SEMICOLON, "Expected ';' after expression.")
         return Stmt.Print(value)
 
     def expression_statement(self):
         expression = self.expression()
-        self._consume(TokenType.SEMICOLON, "Expected ';' after expression.")
+        self._consume(SEMICOLON, "Expected ';' after expression.")
         return Stmt.Expression(expression)
 
     def expression(self):
-        return self.assignment()
-
-    def assignment(self):
-        # Parse the left hand sign as an higher precedent expression
-        expr = self.logical_or()
-        if self._match([TokenType.EQUAL]):
-            equals = self._previous
-            value = self.assignment()
-            if isinstance(expr, Expr.Variable):
-                return Expr.Assign(expr.name, value)
-            # If LHS isn't writable, raise ParseError
-            self._error(equals, "Invalid assignment target.")
-        return expr
-
-    def logical_or(self):
-        expr = self.logical_and()
-        while self._match([TokenType.OR]):
-            operator = self._previous
-            right = self.logical_and()
-            expr = Expr.Logical(expr, operator, right)
-        return expr
-
-    def logical_and(self):
-        expr = self.equality()
-        while self._match([TokenType.AND]):
-            operator = self._previous
-            right = self.equality()
-            expr = Expr.Logical(expr, operator, right)
-        return expr
-
-    def equality(self):
-        expr = self.comparison()
-        while self._match([TokenType.BANG_EQUAL, TokenType.EQUAL_EQUAL]):
-            operator = self._previous
-            right = self.comparison()
-            expr = Expr.Binary(expr, operator, right)
-        return expr
-
-    def comparison(self):
-        expr = self.addition()
-        while self._match([TokenType.GREATER, TokenType.GREATER_EQUAL,
-                           TokenType.LESS, TokenType.LESS_EQUAL]):
-            operator = self._previous
-            right = self.addition()
-            expr = Expr.Binary(expr, operator, right)
-        return expr
-
-    def addition(self):
-        expr = self.multiplication()
-        while self._match([TokenType.PLUS, TokenType.MINUS]):
-            operator = self._previous
-            right = self.multiplication()
-            expr = Expr.Binary(expr, operator, right)
-        return expr
-
-    def multiplication(self):
-        expr = self.unary()
-        while self._match([TokenType.STAR, TokenType.SLASH]):
-            operator = self._previous
-            right = self.unary()
-            expr = Expr.Binary(expr, operator, right)
-        return expr
-
-    def unary(self):
-        if self._match([TokenType.MINUS, TokenType.BANG]):
-            operator = self._previous
-            right = self.unary()
-            expr = Expr.Unary(operator, right)
-            return expr
-        return self.call()
-
-    def call(self):
-        expr = self.primary()
+        '''Parse an expression: operands, and the binary operators which
+        follow them by their precedence in `BINARY_OPERATORS`.
+
+        Where a recursive parser would call itself, for the operand of an
+        operator, or the expression in parentheses, a call or an assignment,
+        what waits for it is pushed onto `stack` instead.
+        '''
+        tokens = self.tokens
+        max_depth = self.max_depth - self.depth
+        deepest = self.deepest_depth - self.depth
+        stack = []
+        # Only the operators which bind at least as tightly as `precedence`
+        # are part of the operand being parsed.
+        precedence = OR_PRECEDENCE
+        operand = True
         while True:
-            if self._match([TokenType.LEFT_PAREN]):
-                expr = self._finish_call(expr)
+            if operand:
+                token = self._next
+                tokentype = token.tokentype
+                if tokentype not in OPERAND_STARTS:
+                    raise self._error(token, 'Expect expression.')
+                depth = len(stack)
+                if depth > max_depth:
+                    raise self._error(token, 'Too deeply nested.')
+                if depth > deepest:
+                    deepest = depth
+                    self.deepest = token
+                    self.deepest_depth = self.depth + depth
+                # `_advance()`, inlined: `token` isn't `EOF`.
+                self._previous = token
+                self._next = next(tokens)
+                if tokentype == IDENTIFIER:
+                    expr = Expr.Variable(token)
+                elif tokentype == NUMBER or tokentype == STRING:
+                    expr = Expr.Literal(token.literal)
+                elif tokentype == MINUS or tokentype == BANG:
+                    stack.append((UNARY, precedence, token, None, None))
+                    precedence = UNARY_PRECEDENCE
+                    continue
+                elif tokentype == LEFT_PAREN:
+                    stack.append((GROUPING, precedence, None, None, None))
+                    precedence = OR_PRECEDENCE
+                    continue
+                else:
+                    expr = Expr.Literal(CONSTANTS[tokentype])
+                operand = False
+
+            token = self._next
+            tokentype = token.tokentype
+            if tokentype == LEFT_PAREN:
+                # Calls bind the tightest, so they can only follow an operand.
+                self._previous = token
+                self._next = next(tokens)
+                if self._check(RIGHT_PAREN):
+                    expr = self._finish_call(expr, [])
+                else:
+                    stack.append((ARGUMENT, precedence, expr, [], None))
+                    precedence = OR_PRECEDENCE
+                    operand = True
+                continue
+            operator = BINARY_OPERATORS.get(tokentype, None)
+            if operator != None and operator[0] >= precedence:
+                self._previous = token
+                self._next = next(tokens)
+                stack.append((BINARY, precedence, expr, token, operator[1]))
+                # Operators are left-associative: the right operand only
+                # takes the operators which bind tighter.
+                precedence = operator[0] + 1
+                operand = True
+                continue
+
+            # `expr` is the whole operand, or expression, being parsed.
+            if precedence > OR_PRECEDENCE:
+                kind, precedence, left, operator, node = stack.pop()
+                if kind == UNARY:
+                    expr = Expr.Unary(left, expr)
+                else:
+                    expr = node(left, operator, expr)
+                continue
+            if self._check(EQUAL):
+                # Parse the right hand side as another assignment.
+                equals = self._advance()
+                stack.append((ASSIGNMENT, OR_PRECEDENCE, expr, equals, None))
+                operand = True
+                continue
+            while stack and stack[-1][0] == ASSIGNMENT:
+                _, _, target, equals, _ = stack.pop()
+                if isinstance(target, Expr.Variable):
+                    expr = Expr.Assign(target.name, expr)
+                else:
+                    # If LHS isn't writable, raise ParseError
+                    self._error(equals, "Invalid assignment target.")
+                    expr = target
+            if not stack:
+                return expr
+            waiting = stack.pop()
+            kind, precedence, callee, arguments, _ = waiting
+            if kind == GROUPING:
+                self._consume(RIGHT_PAREN, "Expect ')' after expression.")
+                expr = Expr.Grouping(expr)
             else:
-                break
-        return expr
-
-    def primary(self):
-        if self._match([TokenType.FALSE]):
-            return Expr.Literal(False)
-        elif self._match([TokenType.TRUE]):
-            return Expr.Literal(True)
-        elif self._match([TokenType.NIL]):
-            return Expr.Literal(None)
-        elif self._match([TokenType.NUMBER, TokenType.STRING]):
-            return Expr.Literal(self._previous.literal)
-        elif self._match([TokenType.LEFT_PAREN]):
-            expr = self.expression()
-            self._consume(TokenType.RIGHT_PAREN, "Expect ')' after expression.")
-            return Expr.Grouping(expr)
-        elif self._match([TokenType.IDENTIFIER]):
-            return Expr.Variable(self._previous)
-        raise self._error(self._peek(), 'Expect expression.')
+                arguments.append(expr)
+                if self._match(COMMA):
+                    stack.append(waiting)
+                    precedence = OR_PRECEDENCE
+                    operand = True
+                else:
+                    expr = self._finish_call(callee, arguments)
 
     def _synchronize(self):
         '''Skip tokens until a new statement is found in case of an error.
         '''
         self._advance()
         while not self._at_end():
-            if self._previous == TokenType.SEMICOLON:
+            if self._previous == SEMICOLON:
                 return
             if self._peek().tokentype in (
-    TokenType.CLASS, TokenType.FUN, TokenType.VAR, TokenType.FOR, TokenType.IF,
-    TokenType.WHILE, TokenType.PRINT, TokenType.RETURN):
+    CLASS, FUN, VAR, FOR, IF,
+    WHILE, PRINT, RETURN):
                 return
             self._advance()
 
     def parse(self):
         statements = []
         while not self._at_end():
-            statements.append(self.declaration())
+            statements.append(self._run(self.declaration()))
         return statements
@@ -1,15 +1,51 @@
 from enum import Enum
 
+from lox import Expr, Stmt
 from lox.visitor import Visitor
 
 FunctionType = Enum('FunctionType', ['NONE', 'FUNCTION'])
 
+class Variable:
+    '''A local variable, and the references to it found so far.
+
+    Whether a variable is captured by a closure is only known once its scope
+    ends, so the references are annotated then.
+    '''
+    def __init__(self, declaration, slot):
+        # The `Stmt.Var` or `Stmt.Function` declaring the variable, or the
+        # function taking it as a parameter.
+        self.declaration = declaration
+        self.slot = slot
+        self.captured = False
+        self.references = []
+
+class Scope(dict):
+    '''Maps the names declared in a scope to whether they are defined yet.
+
+    Every name also gets the next free slot of the scope's `Environment`. The
+    outermost scope of a function additionally gets a slot for every free
+    variable of the function, holding the `Cell` it shares with the scope
+    declaring it.
+    '''
+    def __init__(self, function=None):
+        super().__init__()
+        self.function = function
+        self.variables = {}
+        self.free = {}
+        self.size = 0
+
+    def allocate(self):
+        slot = self.size
+        self.size += 1
+        return slot
+
 class Resolver(Visitor):
-    def __init__(self, lox, interpreter):
-        self.interpreter = interpreter
+    def __init__(self, lox):
         self.lox = lox
         self.scopes = []
         self.current_function = FunctionType.NONE
+        # The `Stmt.Function`s being resolved, innermost last.
+        self.functions = []
 
     @property
     def scope_is_empty(self):
@@ -28,27 +64,89 @@ class Resolver(Visitor):
     def resolve_local(self, expr, name):
         for i in range(len(self.scopes) - 1, -1, -1):
             if name.lexeme in self.scopes[i].keys():
-                self.interpreter.resolve(expr, len(self.scopes) - 1 - i)
-                return
+                variable = self.scopes[i].variables[name.lexeme]
+                break
+        else:
+            # A global, also when an earlier resolution said otherwise.
+            self._bind(expr, None, None, False)
+            for function in self.functions:
+                function.globals.add(name.lexeme)
+            if isinstance(expr, Expr.Assign):
+                self._impure(self.functions)
+            return
+
+        depth = len(self.scopes) - 1 - i
+        functions = [
+            k for k in range(i + 1, len(self.scopes))
+            if self.scopes[k].function != None]
+        if not functions:
+            variable.references.append((expr, depth))
+            return
+
+        # A free variable: every function between the declaration and the
+        # reference passes the cell on, from its declaring scope to a slot of
+        # its own.
+        variable.captured = True
+        index, slot = i, variable.slot
+        for k in functions:
+            scope = self.scopes[k]
+            scope.function.pure = False
+            free = scope.free.get(variable, None)
+            if free == None:
+                free = scope.free[variable] = scope.allocate()
+                scope.function.free.append((k - 1 - index, slot, free))
+            index, slot = k, free
+        self._bind(expr, len(self.scopes) - 1 - index, slot, True)
+
+    def _bind(self, expr, depth, slot, cell):
+        '''Record on the `Expr.Variable` or `Expr.Assign` where its variable
+        lives: `depth` scopes up, in `slot`, and whether it is held in a `Cell`.
+        Globals are left with a `depth` of `None`.
+        '''
+        expr.depth = depth
+        expr.slot = slot
+        expr.cell = cell
+
+    def _impure(self, functions):
+        for function in functions:
+            function.pure = False
 
     def resolve_function(self, stmt, function_type):
         enclosing_function = self.current_function
         self.current_function = function_type
-        self._begin_scope()
+        # The tree is resolved again after the optimizer changed it.
+        stmt.cell_params = []
+        stmt.free = []
+        stmt.pure = True
+        stmt.globals = set()
+        self.functions.append(stmt)
+        self._begin_scope(stmt)
         for param in stmt.params:
-            self._declare(param)
+            self._declare(param, stmt)
             self._define(param)
         self.resolve(stmt.body)
-        self._end_scope()
+        stmt.size = self._end_scope()
+        self.functions.pop()
         self.current_function = enclosing_function
 
-    def _begin_scope(self):
-        self.scopes.append({})
+    def _begin_scope(self, function=None):
+        self.scopes.append(Scope(function))
 
     def _end_scope(self):
-        self.scopes.pop()
+        '''Returns the number of slots the scope needs.'''
+        scope = self.scopes.pop()
+        for variable in scope.variables.values():
+            if variable.captured:
+                if variable.declaration is scope.function:
+                    variable.declaration.cell_params.append(variable.slot)
+                else:
+                    variable.declaration.cell = True
+            for expr, depth in variable.references:
+                self._bind(expr, depth, variable.slot, variable.captured)
+        return scope.size
 
-    def _declare(self, name):
+    def _declare(self, name, declaration):
+        '''Returns the slot of the declared variable, `None` for globals.'''
         if self.scope_is_empty:
             return
         scope = self.scopes[-1]
@@ -58,6 +156,10 @@ class Resolver(Visitor):
             # We don't need to return/stop here, because `self.lox.had_error`
             # gets set and no code would be interpreted.
         scope[name.lexeme] = False
+        if name.lexeme not in scope.variables:
+            scope.variables[name.lexeme] = Variable(
+                declaration, scope.allocate())
+        return scope.variables[name.lexeme].slot
 
     def _define(self, name):
         if self.scope_is_empty:
@@ -65,19 +167,31 @@ class Resolver(Visitor):
         self.scopes[-1][name.lexeme] = True
 
     def visit_BlockStmt(self, stmt):
+        # Only the statements directly in a block declare variables in its
+        # scope. A block without any doesn't get a scope of its own, and runs
+        # in the enclosing one.
+        if not any(isinstance(statement, (Stmt.Var, Stmt.Function))
+                   for statement in stmt.statements):
+            self.resolve(stmt.statements)
+            stmt.size = 0
+            return
         self._begin_scope()
         self.resolve(stmt.statements)
-        self._end_scope()
+        stmt.size = self._end_scope()
 
     def visit_VarStmt(self, stmt):
-        self._declare(stmt.name)
+        stmt.cell = False
+        stmt.slot = self._declare(stmt.name, stmt)
         if stmt.initializer != None:
             self.resolve(stmt.initializer)
         self._define(stmt.name)
 
     def visit_FunctionStmt(self, stmt):
-        self._declare(stmt.name)
+        stmt.cell = False
+        stmt.slot = self._declare(stmt.name, stmt)
         self._define(stmt.name)
+        # Every call of the enclosing functions creates a new function.
+        self._impure(self.functions)
         self.resolve_function(stmt, FunctionType)
 
     def visit_ExpressionStmt(self, stmt):
@@ -90,12 +204,15 @@ class Resolver(Visitor):
             self.resolve(stmt.else_branch)
 
     def visit_PrintStmt(self, stmt):
+        self._impure(self.functions)
         self.resolve(stmt.expression)
 
     def visit_ReturnStmt(self, stmt):
         if self.current_function == FunctionType.NONE:
             self.lox.error(stmt.keyword, "Cannot return from top-level code.")
         if stmt.value != None:
+            if isinstance(stmt.value, Expr.Call):
+                stmt.value.tail = True
             self.resolve(stmt.value)
 
     def visit_WhileStmt(self, stmt):
@@ -119,6 +236,12 @@ class Resolver(Visitor):
         self.resolve(expr.right)
 
     def visit_CallExpr(self, expr):
+        # Which function a global holds is checked when the call is made,
+        # any other callee could be impure.
+        callee = expr.callee
+        if not isinstance(callee, Expr.Variable) or any(
+                callee.name.lexeme in scope for scope in self.scopes):
+            self._impure(self.functions)
         self.resolve(expr.callee)
         for arg in expr.arguments:
             self.resolve(arg)
@@ -1,45 +1,96 @@
-from lox.token import Token
-from lox.tokentype import TokenType
+import re
+
+from lox.token import Token, TokenArray
+from lox.tokentype import (AND, BANG, BANG_EQUAL, CLASS, COMMA, DOT, ELSE,
+    EOF, EQUAL, EQUAL_EQUAL, FALSE, FOR, FUN, GREATER, GREATER_EQUAL,
+    IDENTIFIER, IF, LEFT_BRACE, LEFT_PAREN, LESS, LESS_EQUAL, MINUS, NIL,
+    NUMBER, OR, PLUS, PRINT, RETURN, RIGHT_BRACE, RIGHT_PAREN, SEMICOLON,
+    SLASH, STAR, STRING, SUPER, THIS, TRUE, VAR, WHILE)
 
 KEYWORDS = {
-    "and": TokenType.AND,
-    "class": TokenType.CLASS,
-    "else": TokenType.ELSE,
-    "false": TokenType.FALSE,
-    "for": TokenType.FOR,
-    "fun": TokenType.FUN,
-    "if": TokenType.IF,
-    "nil": TokenType.NIL,
-    "or": TokenType.OR,
-    "print": TokenType.PRINT,
-    "return": TokenType.RETURN,
-    "super": TokenType.SUPER,
-    "this": TokenType.THIS,
-    "true": TokenType.TRUE,
-    "var": TokenType.VAR,
-    "while": TokenType.WHILE
+    "and": AND,
+    "class": CLASS,
+    "else": ELSE,
+    "false": FALSE,
+    "for": FOR,
+    "fun": FUN,
+    "if": IF,
+    "nil": NIL,
+    "or": OR,
+    "print": PRINT,
+    "return": RETURN,
+    "super": SUPER,
+    "this": THIS,
+    "true": TRUE,
+    "var": VAR,
+    "while": WHILE
+}
+
+OPERATORS = {
+    "(": LEFT_PAREN,
+    ")": RIGHT_PAREN,
+    "{": LEFT_BRACE,
+    "}": RIGHT_BRACE,
+    ",": COMMA,
+    ".": DOT,
+    "-": MINUS,
+    "+": PLUS,
+    ";": SEMICOLON,
+    "*": STAR,
+    "/": SLASH,
+    "!": BANG,
+    "!=": BANG_EQUAL,
+    "=": EQUAL,
+    "==": EQUAL_EQUAL,
+    ">": GREATER,
+    ">=": GREATER_EQUAL,
+    "<": LESS,
+    "<=": LESS_EQUAL,
 }
 
+# A whole lexeme, and the whitespace before it, for scanning in bulk. Only
+# ASCII is matched: an identifier or number which Python's `isalnum()` or
+# `isdigit()` would carry on into other characters is left to
+# `Scanner.scan_token`, like errors and unterminated strings are.
+LEXEME = re.compile(r'''
+    [ \t\r]*
+    (?:
+        (?P<newline>\n)
+      | //[^\n]*
+      | (?P<number>[0-9]+(?:\.[0-9]+)?)
+        (?![0-9\x80-\U0010FFFF]|\.[0-9\x80-\U0010FFFF])
+      | (?P<identifier>[A-Za-z][A-Za-z0-9]*)(?![A-Za-z0-9\x80-\U0010FFFF])
+      | (?P<string>"[^"]*")
+      | (?P<operator>[!=<>]=|[(){},.\-+;*/!=<>])
+    )
+''', re.VERBOSE)
+
 class Scanner:
-    def __init__(self, source, lox):
+    def __init__(self, source, lox, bulk=True):
         self.source = source
         self.start = 0
         self.current = 0
         self.line = 1
+        # The tokens `scan_token` found, which `scan` hasn't generated yet,
+        # and the last token found, where errors are reported.
         self.tokens = []
+        self.previous = None
         self.lox = lox
+        # Match whole lexemes with `LEXEME`, rather than going character by
+        # character. The tokens are the same either way.
+        self.bulk = bulk
 
     @property
     def at_end(self):
         return self.current >= len(self.source)
 
     def EOF(self):
-        return Token(TokenType.EOF, "", None, self.line)
+        return Token(EOF, "", None, self.line)
 
     def previous_token(self):
-        if len(self.tokens) == 0:
+        if self.previous == None:
             return self.EOF()
-        return self.tokens[-1]
+        return self.previous
 
     def advance(self):
         self.current = self.current + 1
@@ -47,7 +98,8 @@ class Scanner:
 
     def add_token(self, tokentype, literal=None):
         text = self.source[self.start:self.current]
-        self.tokens.append(Token(tokentype, text, literal, self.line))
+        self.previous = Token(tokentype, text, literal, self.line)
+        self.tokens.append(self.previous)
 
     def _peek(self):
         """
@@ -58,7 +110,7 @@ class Scanner:
         return self.source[self.current]
 
     def _peek_next(self):
-        if self.current + 1 > len(self.source):
+        if self.current + 1 >= len(self.source):
             return '\0'
         return self.source[self.current + 1]
 
@@ -81,21 +133,21 @@ class Scanner:
                 self.advance()
 
         literal = float(self.source[self.start:self.current])
-        self.add_token(TokenType.NUMBER, literal)
+        self.add_token(NUMBER, literal)
 
     def _handle_slash(self):
         if self._is_next('/'): # It is a comment. Ignore until end of line/file.
             while self._peek() != "\n" and not self.at_end:
                 self.advance()
         else:
-            self.add_token(TokenType.SLASH)
+            self.add_token(SLASH)
 
     def _handle_identifier(self):
         while self._peek().isalnum():
             self.advance()
         
         text = self.source[self.start:self.current]
-        tokentype = KEYWORDS.get(text, TokenType.IDENTIFIER)
+        tokentype = KEYWORDS.get(text, IDENTIFIER)
         self.add_token(tokentype)
 
     def _handle_string(self):
@@ -112,42 +164,42 @@ class Scanner:
 
         # Also save the literal value of the string
         literal = self.source[self.start + 1:self.current - 1]
-        self.add_token(TokenType.STRING, literal)
+        self.add_token(STRING, literal)
 
     def scan_token(self):
         c = self.advance()
         if c == '(':
-            self.add_token(TokenType.LEFT_PAREN)
+            self.add_token(LEFT_PAREN)
         elif c == ')':
-            self.add_token(TokenType.RIGHT_PAREN)
+            self.add_token(RIGHT_PAREN)
         elif c == '{':
-            self.add_token(TokenType.LEFT_BRACE)
+            self.add_token(LEFT_BRACE)
         elif c == '}':
-            self.add_token(TokenType.RIGHT_BRACE)
+            self.add_token(RIGHT_BRACE)
         elif c == ',':
-            self.add_token(TokenType.COMMA)
+            self.add_token(COMMA)
         elif c == '.':
-            self.add_token(TokenType.DOT)
+            self.add_token(DOT)
         elif c == '-':
-            self.add_token(TokenType.MINUS)
+            self.add_token(MINUS)
         elif c == '+':
-            self.add_token(TokenType.PLUS)
+            self.add_token(PLUS)
         elif c == ';':
-            self.add_token(TokenType.SEMICOLON)
+            self.add_token(SEMICOLON)
         elif c == '*':
-            self.add_token(TokenType.STAR)
+            self.add_token(STAR)
         elif c == "!":
             self.add_token(
-    TokenType.BANG_EQUAL if self._is_next("=") else TokenType.BANG)
+    BANG_EQUAL if self._is_next("=") else BANG)
         elif c == "=":
             self.add_token(
-    TokenType.EQUAL_EQUAL if self._is_next("=") else TokenType.EQUAL)
+    EQUAL_EQUAL if self._is_next("=") else EQUAL)
         elif c == "<":
             self.add_token(
-    TokenType.LESS_EQUAL if self._is_next("=") else TokenType.LESS)
+    LESS_EQUAL if self._is_next("=") else LESS)
         elif c == ">":
             self.add_token(
-    TokenType.GREATER_EQUAL if self._is_next("=") else TokenType.GREATER)
+    GREATER_EQUAL if self._is_next("=") else GREATER)
         elif c == "/":
             self._handle_slash()
         elif c in (" ", "\r", "\t"): # Empty spaces
@@ -164,12 +216,111 @@ class Scanner:
             else:
                 self.lox.error(self.previous_token(), "Unexpected character.")
 
-    def scan_tokens(self):
-        while not self.at_end:
-            self.start = self.current
+    def _scan_bulk(self):
+        source = self.source
+        token = None
+        line = 1
+        position = 0
+        while True:
+            for lexeme in LEXEME.finditer(source, position):
+                if lexeme.start() != position:
+                    # Skipped something `LEXEME` doesn't match.
+                    break
+                position = lexeme.end()
+                kind = lexeme.lastgroup
+                if kind == None:
+                    # A comment.
+                    continue
+                elif kind == 'newline':
+                    line += 1
+                    continue
+                text = lexeme[kind]
+                if kind == 'operator':
+                    token = Token(OPERATORS[text], text, None, line)
+                elif kind == 'identifier':
+                    token = Token(
+                        KEYWORDS.get(text, IDENTIFIER), text, None, line)
+                elif kind == 'number':
+                    token = Token(NUMBER, text, float(text), line)
+                else:
+                    line += text.count('\n')
+                    token = Token(STRING, text, text[1:-1], line)
+                yield token
+            # Trailing whitespace, or a lexeme `LEXEME` doesn't match.
+            self.start = self.current = position
+            self.line = line
+            if self.at_end:
+                return
+            self.previous = token
             self.scan_token()
+            yield from self.tokens
+            self.tokens.clear()
+            token = self.previous
+            position = self.current
+            line = self.line
+
+    def scan(self):
+        '''Generate the tokens of the source, ending with `EOF`. The source
+        is only scanned as far as the tokens are asked for.
+        '''
+        if self.bulk:
+            yield from self._scan_bulk()
+        else:
+            while not self.at_end:
+                self.start = self.current
+                self.scan_token()
+                yield from self.tokens
+                self.tokens.clear()
 
         # Add EOF when done - We don't use `self.add_token` here because `EOF`
         # has no association with any `text`.
-        self.tokens.append(self.EOF())
-        return self.tokens
+        yield self.EOF()
+
+    def scan_tokens(self):
+        return list(self.scan())
+
+    def scan_compact(self):
+        '''Scan the whole source into a `TokenArray`, without making a
+        `Token`, or copying a lexeme, for the lexemes `LEXEME` matches.
+        '''
+        source = self.source
+        tokens = TokenArray(source)
+        add = tokens.append
+        line = 1
+        position = 0
+        while True:
+            lexemes = LEXEME.finditer(source, position) if self.bulk else ()
+            for lexeme in lexemes:
+                if lexeme.start() != position:
+                    break
+                position = lexeme.end()
+                kind = lexeme.lastgroup
+                if kind == None:
+                    continue
+                elif kind == 'newline':
+                    line += 1
+                    continue
+                start = lexeme.start(kind)
+                if kind == 'operator':
+                    add(OPERATORS[lexeme[kind]], start, position, line)
+                elif kind == 'identifier':
+                    add(KEYWORDS.get(lexeme[kind], IDENTIFIER),
+                        start, position, line)
+                elif kind == 'number':
+                    add(NUMBER, start, position, line)
+                else:
+                    line += source.count('\n', start, position)
+                    add(STRING, start, position, line)
+            self.start = self.current = position
+            self.line = line
+            if self.at_end:
+                break
+            self.previous = tokens[-1] if len(tokens) else None
+            self.scan_token()
+            for token in self.tokens:
+                add(token.tokentype, self.start, self.current, token.line)
+            self.tokens.clear()
+            position = self.current
+            line = self.line
+        add(EOF, position, position, line)
+        return tokens
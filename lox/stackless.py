@@ -0,0 +1,200 @@
+'''Evaluate Lox programs without recursing in Python for Lox calls.
+
+`StacklessInterpreter` executes statements and expressions with generators.
+A Lox call doesn't call the function: the generator evaluating it yields the
+function and its arguments, and `_run` pushes the caller onto an explicit
+list and runs the body of the function, until it returns and the caller is
+resumed. So the depth of Lox recursion is limited by `max_depth`, which is
+reported as a Lox runtime error, rather than by Python's recursion limit.
+'''
+import weakref
+
+from lox import Expr, Stmt
+from lox.environment import Environment
+from lox.exceptions import RuntimeException
+from lox.interpreter import Interpreter, _check_call, _is_true, stringify
+from lox.LoxFunction import LoxFunction, TailCall
+from lox.tokentype import MINUS, OR
+
+# Expressions which can't contain a call, and are evaluated by the
+# tree-walking `Interpreter`.
+LEAVES = (Expr.Literal, Expr.Variable)
+
+class StacklessInterpreter(Interpreter):
+    # Maximum depth of Lox calls, before reporting a stack overflow.
+    max_depth = 10000
+    # Lox functions are run by `_run`, without going through their memo.
+    memoize = False
+
+    def __init__(self, lox):
+        super().__init__(lox)
+        self.depth = 0
+
+    def interpret(self, statements):
+        self.depth = 0
+        try:
+            self._run(self._program(statements))
+        except RuntimeException as err:
+            self.environment = self.global_env
+            self.lox.runtime_error(err)
+
+    def _run(self, generator):
+        '''Run `generator`, and the bodies of the functions it calls.'''
+        frames = []
+        value = None
+        while True:
+            try:
+                function, arguments = generator.send(value)
+            except StopIteration as stop:
+                value = stop.value
+                if type(value) is TailCall:
+                    # The caller is still waiting, for the result of the call
+                    # replacing the returning one.
+                    generator = self._body(value.function, value.arguments)
+                    value = None
+                    continue
+                if not frames:
+                    return value
+                generator, self.environment = frames.pop()
+                self.depth -= 1
+                continue
+            frames.append((generator, self.environment))
+            self.depth += 1
+            generator = self._body(function, arguments)
+            value = None
+
+    def _program(self, statements):
+        for statement in statements:
+            yield from self._exec(statement)
+
+    def _body(self, function, arguments):
+        pool = self.pool
+        environment = self.environment = function._frame(arguments, pool)
+        result = None
+        for statement in function.declaration.body:
+            completion = yield from self._exec(statement)
+            if completion is not None:
+                result = completion[0]
+                break
+        if pool != None:
+            pool.release(environment)
+        return result
+
+    def _eval(self, expr):
+        '''Evaluate `expr`, yielding every Lox function to call.'''
+        if isinstance(expr, LEAVES):
+            return self._evaluate(expr)
+        elif isinstance(expr, Expr.Grouping):
+            return (yield from self._eval(expr.expression))
+        elif isinstance(expr, Expr.Unary):
+            right = yield from self._eval(expr.right)
+            if expr.operator.tokentype == MINUS:
+                if not isinstance(right, float):
+                    raise RuntimeException(
+                        expr.operator, 'Operand must be a number.')
+                return -right
+            return not _is_true(right)
+        elif isinstance(expr, Expr.Binary):
+            # Most operands are leaves, which don't need a generator.
+            left = expr.left
+            if isinstance(left, LEAVES):
+                left = self._evaluate(left)
+            else:
+                left = yield from self._eval(left)
+            right = expr.right
+            if isinstance(right, LEAVES):
+                right = self._evaluate(right)
+            else:
+                right = yield from self._eval(right)
+            return self._binary(expr, left, right)
+        elif isinstance(expr, Expr.Logical):
+            left = yield from self._eval(expr.left)
+            if expr.operator.tokentype == OR:
+                if _is_true(left):
+                    return left
+            elif not _is_true(left):
+                return left
+            return (yield from self._eval(expr.right))
+        elif isinstance(expr, Expr.Assign):
+            value = yield from self._eval(expr.value)
+            self._assign(expr, value)
+            return value
+
+        callee = yield from self._eval(expr.callee)
+        arguments = []
+        for argument in expr.arguments:
+            if isinstance(argument, LEAVES):
+                arguments.append(self._evaluate(argument))
+            else:
+                arguments.append((yield from self._eval(argument)))
+        checked = expr.checked_callee
+        if checked is None or checked() is not callee:
+            _check_call(expr, callee, arguments)
+            expr.checked_callee = weakref.ref(callee)
+        if not isinstance(callee, LoxFunction):
+            return callee(self, arguments)
+        if expr.tail:
+            return TailCall(callee, arguments)
+        if self.depth >= self.max_depth:
+            raise RuntimeException(expr.paren, "Stack overflow.")
+        return (yield callee, arguments)
+
+    def _exec(self, stmt):
+        '''Execute `stmt`, yielding every Lox function to call. Returns a
+        completion, like `Interpreter._execute`.
+        '''
+        if isinstance(stmt, Stmt.Expression):
+            yield from self._eval(stmt.expression)
+        elif isinstance(stmt, Stmt.Print):
+            print(stringify((yield from self._eval(stmt.expression))))
+        elif isinstance(stmt, Stmt.Var):
+            value = None
+            if stmt.initializer != None:
+                value = yield from self._eval(stmt.initializer)
+            self._define(stmt, stmt.name, value)
+        elif isinstance(stmt, Stmt.Block):
+            return (yield from self._block(stmt))
+        elif isinstance(stmt, Stmt.If):
+            if _is_true((yield from self._eval(stmt.condition))):
+                return (yield from self._exec(stmt.then_branch))
+            elif stmt.else_branch != None:
+                return (yield from self._exec(stmt.else_branch))
+        elif isinstance(stmt, Stmt.While):
+            while _is_true((yield from self._eval(stmt.condition))):
+                completion = yield from self._exec(stmt.body)
+                if completion is not None:
+                    return completion
+        elif isinstance(stmt, Stmt.Function):
+            self.visit_FunctionStmt(stmt)
+        else:
+            value = None
+            if stmt.value != None:
+                value = yield from self._eval(stmt.value)
+            return (value,)
+
+    def _block(self, stmt):
+        if stmt.size == 0:
+            for statement in stmt.statements:
+                completion = yield from self._exec(statement)
+                if completion is not None:
+                    return completion
+            return
+
+        # An error abandons the whole program, so the environment only needs
+        # restoring on the way out of the block.
+        previous = self.environment
+        pool = self.pool
+        if pool == None:
+            environment = Environment(previous, stmt.size)
+        else:
+            environment = pool.acquire(previous, stmt.size)
+        self.environment = environment
+        completion = None
+        for statement in stmt.statements:
+            completion = yield from self._exec(statement)
+            if completion is not None:
+                break
+        self.environment = previous
+        if pool != None:
+            pool.release(environment)
+        return completion
@@ -0,0 +1,84 @@
+'''Tiered execution: start out tree-walking, compile what turns out to be hot.
+
+`TieredInterpreter` counts the calls of every `Stmt.Function` and the
+iterations (loop back-edges) of every `Stmt.While`, on the node itself. Once
+a count reaches `threshold`, the function body or loop is compiled with
+`ClosureCompiler` and the compiled form is used from then on, even by a loop
+which is still running. Cold setup code never pays for compilation.
+'''
+import sys
+import time
+
+from lox.closure_compiler import ClosureCompiler
+from lox.interpreter import Interpreter, _is_true
+
+class Promotion:
+    def __init__(self, kind, name, line, count, elapsed):
+        self.kind = kind
+        self.name = name
+        self.line = line
+        self.count = count
+        # Seconds since the interpreter was created.
+        self.elapsed = elapsed
+
+    def __str__(self):
+        unit = 'calls' if self.kind == 'function' else 'iterations'
+        return (f'[Line {self.line}] Compiled {self.kind} {self.name} after '
+                f'{self.count} {unit} ({self.elapsed:.3f}s)')
+
+class TieredInterpreter(Interpreter):
+    # Calls or loop iterations before a function or loop gets compiled.
+    threshold = 100
+
+    def __init__(self, lox):
+        super().__init__(lox)
+        self.started = time.perf_counter()
+        self.promotions = []
+
+    def _promote(self, node, statements, kind, name, line):
+        compiled = node.compiled = ClosureCompiler(self).compile(statements)
+        self.promotions.append(Promotion(
+            kind, name, line, node.count,
+            time.perf_counter() - self.started))
+        return compiled
+
+    def report(self):
+        for promotion in self.promotions:
+            print(promotion, file=sys.stderr)
+
+    def _execute_body(self, declaration, environment):
+        body = declaration.compiled
+        if body == None:
+            declaration.count += 1
+            if declaration.count < self.threshold:
+                return super()._execute_body(declaration, environment)
+            name = declaration.name
+            body = self._promote(
+                declaration, declaration.body, 'function', name.lexeme,
+                name.line)
+        completion = body(environment)
+        if completion != None:
+            return completion[0]
+
+    def visit_WhileStmt(self, stmt):
+        loop = stmt.compiled
+        if loop == None:
+            count = stmt.count
+            try:
+                while _is_true(self._evaluate(stmt.condition)):
+                    completion = self._execute(stmt.body)
+                    if completion is not None:
+                        return completion
+                    count += 1
+                    if count >= self.threshold:
+                        break
+                else:
+                    return
+            finally:
+                stmt.count = count
+            # The loop is still running, the compiled version picks up with
+            # the next check of the condition.
+            loop = self._promote(
+                stmt, [stmt], 'loop', stmt.keyword.lexeme, stmt.keyword.line)
+
+        return loop(self.environment)
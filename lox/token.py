@@ -1,4 +1,10 @@
+from array import array
+
+from lox.tokentype import NUMBER, STRING, TokenType
+
 class Token:
+    __slots__ = ('tokentype', 'lexeme', 'literal', 'line')
+
     def __init__(self, tokentype, lexeme, literal, line):
         self.tokentype = tokentype
         self.lexeme = lexeme
@@ -7,3 +13,46 @@ class Token:
     
     def __str__(self):
         return f"{self.tokentype} {self.lexeme} {self.literal}"
+
+# `TokenType` by value, as stored in `TokenArray.kinds`.
+KINDS = [None, *TokenType]
+
+class TokenArray:
+    '''The tokens of `source`, kept as offsets into it rather than as `Token`
+    objects: parallel arrays of their kinds, starts, lengths and lines.
+
+    Indexing (or iterating) makes the `Token`, and copies its lexeme out of
+    the source, only then. Literals are worked out from the lexeme too.
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.lengths = array('I')
+        self.lines = array('I')
+
+    def append(self, tokentype, start, end, line):
+        self.kinds.append(tokentype)
+        self.starts.append(start)
+        self.lengths.append(end - start)
+        self.lines.append(line)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def lexeme(self, index):
+        start = self.starts[index]
+        return self.source[start:start + self.lengths[index]]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        tokentype = KINDS[self.kinds[index]]
+        lexeme = self.lexeme(index)
+        if tokentype == STRING:
+            literal = lexeme[1:-1]
+        elif tokentype == NUMBER:
+            literal = float(lexeme)
+        else:
+            literal = None
+        return Token(tokentype, lexeme, literal, self.lines[index])
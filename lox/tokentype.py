@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 types = [
   # Single-character tokens.
@@ -21,4 +21,54 @@ types = [
   'EOF'
 ]
 
-TokenType = Enum('TokenType', types)
+class _Kind(IntEnum):
+    # Print as `TokenType.PLUS` rather than as the int, when debugging.
+    __str__ = Enum.__str__
+
+# Token kinds are small ints, so comparing them costs no more than comparing
+# ints.
+TokenType = _Kind('TokenType', types)
+
+# Every kind is also a module constant. The hot paths import them, so that
+# `PLUS` is a global lookup instead of an attribute lookup on `TokenType`.
+# They are spelled out, rather than added to `globals()` in a loop, so that
+# tools reading the source can resolve them.
+LEFT_PAREN = TokenType.LEFT_PAREN
+RIGHT_PAREN = TokenType.RIGHT_PAREN
+LEFT_BRACE = TokenType.LEFT_BRACE
+RIGHT_BRACE = TokenType.RIGHT_BRACE
+COMMA = TokenType.COMMA
+DOT = TokenType.DOT
+MINUS = TokenType.MINUS
+PLUS = TokenType.PLUS
+SEMICOLON = TokenType.SEMICOLON
+SLASH = TokenType.SLASH
+STAR = TokenType.STAR
+BANG = TokenType.BANG
+BANG_EQUAL = TokenType.BANG_EQUAL
+EQUAL = TokenType.EQUAL
+EQUAL_EQUAL = TokenType.EQUAL_EQUAL
+GREATER = TokenType.GREATER
+GREATER_EQUAL = TokenType.GREATER_EQUAL
+LESS = TokenType.LESS
+LESS_EQUAL = TokenType.LESS_EQUAL
+IDENTIFIER = TokenType.IDENTIFIER
+STRING = TokenType.STRING
+NUMBER = TokenType.NUMBER
+AND = TokenType.AND
+CLASS = TokenType.CLASS
+ELSE = TokenType.ELSE
+FALSE = TokenType.FALSE
+FUN = TokenType.FUN
+FOR = TokenType.FOR
+IF = TokenType.IF
+NIL = TokenType.NIL
+OR = TokenType.OR
+PRINT = TokenType.PRINT
+RETURN = TokenType.RETURN
+SUPER = TokenType.SUPER
+THIS = TokenType.THIS
+TRUE = TokenType.TRUE
+VAR = TokenType.VAR
+WHILE = TokenType.WHILE
+EOF = TokenType.EOF
@@ -0,0 +1,485 @@
+'''Translate resolved Lox programs to Python source, and run that instead.
+
+Lox locals become Python locals, functions become nested `def`s and
+arithmetic becomes Python arithmetic guarded by inline type checks, so that
+the generated module runs on CPython's own bytecode engine.
+
+Lox creates a new scope every time a block runs, whereas a Python function
+has a single scope. Every Lox local therefore gets a unique Python name, and
+locals which are captured by a closure are boxed in a one element list which
+is created when the declaration runs. Functions receive the boxes they
+capture as keyword-only default arguments, so every closure keeps the boxes
+that existed when it was declared.
+
+A call in tail position returns a `TailCall` rather than making the call, and
+the caller makes it instead, like the other engines do, so tail recursion
+runs in constant Python stack.
+'''
+import math
+import sys
+
+from lox.exceptions import RuntimeException
+from lox.interpreter import Interpreter, stringify
+from lox.LoxCallable import LoxCallable
+from lox.LoxFunction import TailCall
+from lox.tokentype import (BANG_EQUAL, EQUAL_EQUAL, GREATER, GREATER_EQUAL,
+    LESS, LESS_EQUAL, MINUS, OR, PLUS, SLASH, STAR)
+from lox.visitor import Visitor
+
+# Python operators for the binary operators which only accept two numbers.
+NUMERIC_OPERATORS = {
+    MINUS: '-',
+    STAR: '*',
+    GREATER: '>',
+    GREATER_EQUAL: '>=',
+    LESS: '<',
+    LESS_EQUAL: '<=',
+}
+
+class PythonFunction(LoxCallable):
+    def __init__(self, function, name, parameters):
+        self.function = function
+        self.name = name
+        self.parameters = parameters
+
+    def __call__(self, interpreter, arguments):
+        return _trampoline(self.function(*arguments))
+
+    @property
+    def arity(self):
+        return self.parameters
+
+    def __str__(self):
+        return f"<fn {self.name}>"
+
+def _trampoline(result):
+    '''Make the calls a function returned as `TailCall`s instead of making
+    them, until one returns a value, so tail calls don't grow the stack.
+    '''
+    while type(result) is TailCall:
+        result = result.function(*result.arguments)
+    return result
+
+def _number_error(token):
+    raise RuntimeException(token, 'Operand must be a number.')
+
+def _zero_error(token):
+    raise RuntimeException(token, "Cannot divide by zero.")
+
+def _undefined(token):
+    raise RuntimeException(token, f'Undefined name {token.lexeme}.')
+
+def _add(left, right, token):
+    # This handles both the cases - when (left, right) are float or str
+    try:
+        return left + right
+    except TypeError:
+        raise RuntimeException(
+            token, 'Operands must be two numbers or two strings.')
+
+def _set_box(box, value):
+    box[0] = value
+    return value
+
+class _Scopes(Visitor):
+    '''Finds the declaration every local refers to, and which locals are
+    captured by a closure, before any code is generated.
+    '''
+    def __init__(self):
+        self.scopes = []
+        self.functions = []
+        # The function declaring each local, `None` for top-level blocks.
+        self.owners = {}
+        self.bindings = {}
+        self.captured = set()
+        # The boxes every function has to receive when it is declared.
+        self.free = {}
+
+    @property
+    def function(self):
+        return self.functions[-1] if self.functions else None
+
+    def analyse(self, statements):
+        for statement in statements:
+            self.visit(statement)
+
+    def _declare(self, name):
+        if not self.scopes:
+            return
+        self.scopes[-1][name.lexeme] = name
+        self.owners[name] = self.function
+
+    def _bind(self, expr, name):
+        if expr.depth == None:
+            return
+        for scope in reversed(self.scopes):
+            if name.lexeme in scope:
+                declaration = scope[name.lexeme]
+                break
+        self.bindings[expr] = declaration
+        owner = self.owners[declaration]
+        if owner == self.function:
+            return
+        self.captured.add(declaration)
+        # Every function between the declaration and the use needs the box,
+        # to pass it on to the closures it creates.
+        for function in reversed(self.functions):
+            if function == owner:
+                break
+            if declaration not in self.free[function]:
+                self.free[function].append(declaration)
+
+    def visit_BlockStmt(self, stmt):
+        self.scopes.append({})
+        self.analyse(stmt.statements)
+        self.scopes.pop()
+
+    def visit_VarStmt(self, stmt):
+        if stmt.initializer != None:
+            self.visit(stmt.initializer)
+        self._declare(stmt.name)
+
+    def visit_FunctionStmt(self, stmt):
+        self._declare(stmt.name)
+        self.functions.append(stmt)
+        self.free[stmt] = []
+        self.scopes.append({})
+        for param in stmt.params:
+            self._declare(param)
+        self.analyse(stmt.body)
+        self.scopes.pop()
+        self.functions.pop()
+
+    def visit_ExpressionStmt(self, stmt):
+        self.visit(stmt.expression)
+
+    def visit_PrintStmt(self, stmt):
+        self.visit(stmt.expression)
+
+    def visit_ReturnStmt(self, stmt):
+        if stmt.value != None:
+            self.visit(stmt.value)
+
+    def visit_IfStmt(self, stmt):
+        self.visit(stmt.condition)
+        self.visit(stmt.then_branch)
+        if stmt.else_branch != None:
+            self.visit(stmt.else_branch)
+
+    def visit_WhileStmt(self, stmt):
+        self.visit(stmt.condition)
+        self.visit(stmt.body)
+
+    def visit_VariableExpr(self, expr):
+        self._bind(expr, expr.name)
+
+    def visit_AssignExpr(self, expr):
+        self.visit(expr.value)
+        self._bind(expr, expr.name)
+
+    def visit_BinaryExpr(self, expr):
+        self.visit(expr.left)
+        self.visit(expr.right)
+
+    def visit_LogicalExpr(self, expr):
+        self.visit(expr.left)
+        self.visit(expr.right)
+
+    def visit_GroupingExpr(self, expr):
+        self.visit(expr.expression)
+
+    def visit_UnaryExpr(self, expr):
+        self.visit(expr.right)
+
+    def visit_CallExpr(self, expr):
+        self.visit(expr.callee)
+        for argument in expr.arguments:
+            self.visit(argument)
+
+class Transpiler(Visitor):
+    '''Generates the source of a Python module defining `_main()`.
+
+    Expressions are translated to Python expression strings. Statements are
+    appended to `self.lines`, indented by `self.indent`.
+    '''
+    def __init__(self):
+        self.scopes = _Scopes()
+        self.lines = []
+        self.indent = 1
+        # Number of enclosing Lox scopes, declarations outside of any are
+        # globals.
+        self.depth = 0
+        self.names = {}
+        # Values the generated code refers to by name, mostly tokens needed
+        # to report runtime errors.
+        self.constants = {}
+        self.temporaries = 0
+
+    def transpile(self, statements):
+        self.scopes.analyse(statements)
+        self.lines.append('def _main():')
+        self._suite(statements)
+        return '\n'.join(self.lines) + '\n'
+
+    def _emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def _suite(self, statements):
+        length = len(self.lines)
+        for statement in statements:
+            self.visit(statement)
+        if len(self.lines) == length:
+            self._emit('pass')
+
+    def _indented(self, statement):
+        self.indent += 1
+        self._suite([statement])
+        self.indent -= 1
+
+    def _constant(self, value):
+        name = f'_k{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+    def _temporary(self):
+        self.temporaries += 1
+        return f'_t{self.temporaries}'
+
+    def _truthy(self, code):
+        value = self._temporary()
+        return f'(({value} := {code}) is not None and {value} is not False)'
+
+    def _name(self, declaration):
+        if declaration not in self.names:
+            # Variables added by the optimizer have a space in their name.
+            lexeme = declaration.lexeme.replace(' ', '_')
+            self.names[declaration] = f'{lexeme}_{len(self.names)}'
+        return self.names[declaration]
+
+    def _is_boxed(self, declaration):
+        return declaration in self.scopes.captured
+
+    def _code(self, expr):
+        return self.visit(expr)
+
+    def _define(self, name, code):
+        '''Emit the declaration of variable `name` with the value `code`.'''
+        if self.depth == 0:
+            self._emit(f'_define_global({name.lexeme!r}, {code})')
+        elif self._is_boxed(name):
+            self._emit(f'{self._name(name)} = [{code}]')
+        else:
+            self._emit(f'{self._name(name)} = {code}')
+
+    def visit_LiteralExpr(self, expr):
+        value = expr.value
+        if isinstance(value, float) and not math.isfinite(value):
+            return self._constant(value)
+        return repr(value)
+
+    def visit_GroupingExpr(self, expr):
+        return f'({self._code(expr.expression)})'
+
+    def visit_UnaryExpr(self, expr):
+        right = self._code(expr.right)
+        if expr.operator.tokentype == MINUS:
+            value = self._temporary()
+            token = self._constant(expr.operator)
+            return (f'(-{value} if type({value} := {right}) is float '
+                    f'else _number_error({token}))')
+        return f'(not {self._truthy(right)})'
+
+    def visit_BinaryExpr(self, expr):
+        left = self._code(expr.left)
+        right = self._code(expr.right)
+        tokentype = expr.operator.tokentype
+        if tokentype == EQUAL_EQUAL:
+            return f'({left} == {right})'
+        elif tokentype == BANG_EQUAL:
+            return f'({left} != {right})'
+
+        a = self._temporary()
+        b = self._temporary()
+        token = self._constant(expr.operator)
+        numbers = (f'(type({a} := {left}) is float) & '
+                   f'(type({b} := {right}) is float)')
+        if tokentype == PLUS:
+            return f'({a} + {b} if {numbers} else _add({a}, {b}, {token}))'
+        elif tokentype == SLASH:
+            return (f'(({a} / {b} if {b} != 0 else _zero_error({token})) '
+                    f'if {numbers} else _number_error({token}))')
+        operator = NUMERIC_OPERATORS[tokentype]
+        return f'({a} {operator} {b} if {numbers} else _number_error({token}))'
+
+    def visit_VariableExpr(self, expr):
+        declaration = self.scopes.bindings.get(expr, None)
+        if declaration == None:
+            lexeme = expr.name.lexeme
+            token = self._constant(expr.name)
+            cell = self._temporary()
+            return (f'({cell}.value if ({cell} := G.get({lexeme!r})) '
+                    f'is not None else _undefined({token}))')
+        if self._is_boxed(declaration):
+            return f'{self._name(declaration)}[0]'
+        return self._name(declaration)
+
+    def visit_AssignExpr(self, expr):
+        value = self._code(expr.value)
+        declaration = self.scopes.bindings.get(expr, None)
+        if declaration == None:
+            token = self._constant(expr.name)
+            return f'_set_global({token}, {value})'
+        if self._is_boxed(declaration):
+            return f'_set_box({self._name(declaration)}, {value})'
+        return f'({self._name(declaration)} := {value})'
+
+    def visit_LogicalExpr(self, expr):
+        left = self._code(expr.left)
+        right = self._code(expr.right)
+        value = self._temporary()
+        truthy = f'(({value} := {left}) is not None and {value} is not False)'
+        if expr.operator.tokentype == OR:
+            return f'({value} if {truthy} else {right})'
+        return f'({right} if {truthy} else {value})'
+
+    def visit_CallExpr(self, expr):
+        callee = self._temporary()
+        function = self._code(expr.callee)
+        token = self._constant(expr.paren)
+        count = len(expr.arguments)
+        arguments = ', '.join(
+            self._code(argument) for argument in expr.arguments)
+        # Functions defined in Lox are called directly, anything else goes
+        # through the generic checks in `_call` once the arguments are
+        # evaluated.
+        call = (f'({callee}.function if type({callee} := {function}) is '
+                f'PythonFunction and {callee}.parameters == {count} '
+                f'else _call({callee}, {token}))')
+        if expr.tail:
+            # The caller makes the call, once this function has returned.
+            return f'TailCall({call}, ({arguments}{"," if count else ""}))'
+        result = self._temporary()
+        return (f'({result} if type({result} := {call}({arguments})) is not '
+                f'TailCall else _trampoline({result}))')
+
+    def visit_ExpressionStmt(self, stmt):
+        self._emit(f'({self._code(stmt.expression)})')
+
+    def visit_PrintStmt(self, stmt):
+        self._emit(f'print(stringify({self._code(stmt.expression)}))')
+
+    def visit_VarStmt(self, stmt):
+        value = 'None'
+        if stmt.initializer != None:
+            value = self._code(stmt.initializer)
+        self._define(stmt.name, value)
+
+    def visit_BlockStmt(self, stmt):
+        self.depth += 1
+        self._suite(stmt.statements)
+        self.depth -= 1
+
+    def visit_IfStmt(self, stmt):
+        self._emit(f'if {self._truthy(self._code(stmt.condition))}:')
+        self._indented(stmt.then_branch)
+        if stmt.else_branch != None:
+            self._emit('else:')
+            self._indented(stmt.else_branch)
+
+    def visit_WhileStmt(self, stmt):
+        self._emit(f'while {self._truthy(self._code(stmt.condition))}:')
+        self._indented(stmt.body)
+
+    def visit_FunctionStmt(self, stmt):
+        name = stmt.name
+        boxed = self.depth > 0 and self._is_boxed(name)
+        if boxed:
+            # The function refers to itself, so its box has to exist before
+            # it is bound to the function.
+            self._emit(f'{self._name(name)} = [None]')
+
+        function = f'_{self._name(name)}'
+        parameters = [self._name(param) for param in stmt.params]
+        free = [self._name(declaration)
+                for declaration in self.scopes.free[stmt]]
+        if free:
+            parameters.append('*')
+            parameters.extend(f'{box}={box}' for box in free)
+        self._emit(f'def {function}({", ".join(parameters)}):')
+
+        self.indent += 1
+        self.depth += 1
+        for param in stmt.params:
+            if self._is_boxed(param):
+                self._emit(f'{self._name(param)} = [{self._name(param)}]')
+        self._suite(stmt.body)
+        self.depth -= 1
+        self.indent -= 1
+
+        value = (f'PythonFunction({function}, {name.lexeme!r}, '
+                 f'{len(stmt.params)})')
+        if boxed:
+            self._emit(f'{self._name(name)}[0] = {value}')
+        else:
+            self._define(name, value)
+
+    def visit_ReturnStmt(self, stmt):
+        if stmt.value == None:
+            self._emit('return None')
+        else:
+            self._emit(f'return {self._code(stmt.value)}')
+
+class PythonInterpreter(Interpreter):
+    '''Runs programs by translating them to Python with `Transpiler`.
+
+    Set `dump_source` to print every generated module before it runs.
+    '''
+    dump_source = False
+
+    def interpret(self, statements):
+        transpiler = Transpiler()
+        source = transpiler.transpile(statements)
+        if self.dump_source:
+            print(source, file=sys.stderr)
+        try:
+            code = compile(source, '<lox>', 'exec')
+        except (SyntaxError, RecursionError) as err:
+            # Nesting CPython can't compile, like more than 20 loops or about
+            # 100 blocks inside each other. Every engine is a tree-walking
+            # `Interpreter` as well, so walk the tree instead.
+            if self.dump_source:
+                print(f'# Not compiled: {err}', file=sys.stderr)
+            super().interpret(statements)
+            return
+
+        namespace = dict(transpiler.constants)
+        namespace.update(
+            G=self.global_env.cells, PythonFunction=PythonFunction,
+            TailCall=TailCall, _trampoline=_trampoline,
+            _define_global=self.global_env.define,
+            stringify=stringify, _add=_add, _call=self._call,
+            _number_error=_number_error, _set_box=_set_box,
+            _set_global=self._set_global, _undefined=_undefined,
+            _zero_error=_zero_error)
+        exec(code, namespace)
+        try:
+            namespace['_main']()
+        except RuntimeException as err:
+            self.lox.runtime_error(err)
+
+    def _call(self, callee, paren):
+        def call(*arguments):
+            if not isinstance(callee, LoxCallable):
+                raise RuntimeException(
+                    paren, "Can only call functions and classes.")
+            if len(arguments) != callee.arity:
+                raise RuntimeException(
+                    paren,
+                    f"Expected {callee.arity} arguments, "
+                    f"but got {len(arguments)}.")
+            return callee(self, list(arguments))
+        return call
+
+    def _set_global(self, name, value):
+        self.global_env.assign(name, value)
+        return value
@@ -8,6 +8,21 @@ class Visitor:
     def visit_BinaryExpr(self, expr):
         pass
 
+    def visit_FloatAddExpr(self, expr):
+        return self.visit_BinaryExpr(expr)
+
+    def visit_StringConcatExpr(self, expr):
+        return self.visit_BinaryExpr(expr)
+
+    def visit_FloatArithmeticExpr(self, expr):
+        return self.visit_BinaryExpr(expr)
+
+    def visit_FloatCompareExpr(self, expr):
+        return self.visit_BinaryExpr(expr)
+
+    def visit_LocalCompareExpr(self, expr):
+        return self.visit_BinaryExpr(expr)
+
     def visit_GroupingExpr(self, expr):
         pass
 
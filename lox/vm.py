@@ -0,0 +1,254 @@
+'''A stack-based virtual machine for the bytecode emitted by `lox.compiler`.
+
+The whole program runs in a single dispatch loop. Lox calls push a frame onto
+an explicit list instead of recursing in Python, and operands live on one
+shared value stack.
+'''
+from lox.compiler import (
+    ADD, CALL, CLOSURE, CONSTANT, DEFINE_CELL, DEFINE_GLOBAL, DEFINE_LOCAL,
+    DIVIDE, EQUAL, FALSE, GET_CELL, GET_FREE, GET_GLOBAL, GET_LOCAL, GREATER,
+    GREATER_EQUAL, JUMP, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, LESS,
+    LESS_EQUAL, MULTIPLY, NEGATE, NEW_CELL, NIL, NOT, NOT_EQUAL, POP,
+    POP_JUMP_IF_FALSE, PRINT, RETURN, SET_CELL, SET_FREE, SET_GLOBAL,
+    SET_LOCAL, SUBTRACT, TRUE, Compiler)
+from lox.environment import Cell
+from lox.exceptions import RuntimeException
+from lox.interpreter import stringify
+from lox.LoxCallable import LoxCallable
+from lox.native_functions import Clock
+from lox.token import Token
+
+# Maximum depth of Lox calls, before reporting a stack overflow.
+FRAMES_MAX = 100000
+
+class Closure(LoxCallable):
+    def __init__(self, proto, cells):
+        self.proto = proto
+        self.cells = cells
+
+    def __call__(self, interpreter, arguments):
+        return interpreter.run(self, arguments)
+
+    @property
+    def arity(self):
+        return self.proto.arity
+
+    def __str__(self):
+        return f"<fn {self.proto.name}>"
+
+def _runtime_error(proto, ip, message):
+    # Only the line of the offending token survives compilation.
+    token = Token(None, None, None, proto.lines[ip])
+    return RuntimeException(token, message)
+
+class VM:
+    def __init__(self, lox):
+        self.lox = lox
+        self.globals = {"clock": Clock()}
+
+    def interpret(self, statements):
+        script = Compiler().compile(statements)
+        try:
+            self.run(Closure(script, ()), [])
+        except RuntimeException as err:
+            self.lox.runtime_error(err)
+
+    def run(self, closure, arguments):
+        '''Call `closure` and run until it returns.'''
+        globals_ = self.globals
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+
+        proto = closure.proto
+        code = proto.code
+        constants = proto.constants
+        cells = closure.cells
+        slots = list(arguments) + [None] * (proto.slot_count - proto.arity)
+        for slot in proto.cell_params:
+            slots[slot] = Cell(slots[slot])
+        ip = 0
+
+        while True:
+            op = code[ip]
+            if op == GET_LOCAL:
+                push(slots[code[ip + 1]])
+                ip += 2
+            elif op == CONSTANT:
+                push(constants[code[ip + 1]])
+                ip += 2
+            elif op == SET_LOCAL:
+                slots[code[ip + 1]] = stack[-1]
+                ip += 2
+            elif op == POP_JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+            elif op == JUMP:
+                ip = code[ip + 1]
+            elif op == POP:
+                pop()
+                ip += 1
+            elif op == GET_GLOBAL:
+                name = constants[code[ip + 1]]
+                try:
+                    push(globals_[name])
+                except KeyError:
+                    raise _runtime_error(proto, ip, f'Undefined name {name}.')
+                ip += 2
+            elif op == ADD:
+                b = pop()
+                # This handles both the cases - when operands are float or str
+                try:
+                    stack[-1] = stack[-1] + b
+                except TypeError:
+                    raise _runtime_error(
+                        proto, ip,
+                        'Operands must be two numbers or two strings.')
+                ip += 1
+            elif SUBTRACT <= op <= LESS_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise _runtime_error(
+                        proto, ip, 'Operand must be a number.')
+                if op == SUBTRACT:
+                    stack[-1] = a - b
+                elif op == LESS:
+                    stack[-1] = a < b
+                elif op == MULTIPLY:
+                    stack[-1] = a * b
+                elif op == DIVIDE:
+                    if b == 0:
+                        raise _runtime_error(
+                            proto, ip, "Cannot divide by zero.")
+                    stack[-1] = a / b
+                elif op == LESS_EQUAL:
+                    stack[-1] = a <= b
+                elif op == GREATER:
+                    stack[-1] = a > b
+                else:
+                    stack[-1] = a >= b
+                ip += 1
+            elif op == CALL:
+                count = code[ip + 1]
+                callee = stack[-count - 1]
+                if not isinstance(callee, LoxCallable):
+                    raise _runtime_error(
+                        proto, ip, "Can only call functions and classes.")
+                if count != callee.arity:
+                    raise _runtime_error(
+                        proto, ip,
+                        f"Expected {callee.arity} arguments, but got {count}.")
+                start = len(stack) - count
+                if type(callee) is not Closure:
+                    arguments = stack[start:]
+                    del stack[start - 1:]
+                    push(callee(self, arguments))
+                    ip += 2
+                    continue
+                if len(frames) == FRAMES_MAX:
+                    raise _runtime_error(proto, ip, "Stack overflow.")
+                frames.append((proto, cells, slots, ip + 2))
+                proto = callee.proto
+                code = proto.code
+                constants = proto.constants
+                cells = callee.cells
+                slots = stack[start:]
+                del stack[start - 1:]
+                if proto.slot_count > count:
+                    slots.extend([None] * (proto.slot_count - count))
+                for slot in proto.cell_params:
+                    slots[slot] = Cell(slots[slot])
+                ip = 0
+            elif op == RETURN:
+                if not frames:
+                    return pop()
+                proto, cells, slots, ip = frames.pop()
+                code = proto.code
+                constants = proto.constants
+            elif op == GET_CELL:
+                push(slots[code[ip + 1]].value)
+                ip += 2
+            elif op == GET_FREE:
+                push(cells[code[ip + 1]].value)
+                ip += 2
+            elif op == SET_CELL:
+                slots[code[ip + 1]].value = stack[-1]
+                ip += 2
+            elif op == SET_FREE:
+                cells[code[ip + 1]].value = stack[-1]
+                ip += 2
+            elif op == DEFINE_LOCAL:
+                slots[code[ip + 1]] = pop()
+                ip += 2
+            elif op == DEFINE_CELL:
+                slots[code[ip + 1]] = Cell(pop())
+                ip += 2
+            elif op == NEW_CELL:
+                slots[code[ip + 1]] = Cell(None)
+                ip += 2
+            elif op == EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] == b
+                ip += 1
+            elif op == NOT_EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] != b
+                ip += 1
+            elif op == NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+                ip += 1
+            elif op == NEGATE:
+                if type(stack[-1]) is not float:
+                    raise _runtime_error(
+                        proto, ip, 'Operand must be a number.')
+                stack[-1] = -stack[-1]
+                ip += 1
+            elif op == JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    pop()
+                    ip += 2
+            elif op == JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    pop()
+                    ip += 2
+                else:
+                    ip = code[ip + 1]
+            elif op == NIL:
+                push(None)
+                ip += 1
+            elif op == TRUE:
+                push(True)
+                ip += 1
+            elif op == FALSE:
+                push(False)
+                ip += 1
+            elif op == SET_GLOBAL:
+                name = constants[code[ip + 1]]
+                if name not in globals_:
+                    raise _runtime_error(
+                        proto, ip, f'Undefined variable {name}.')
+                globals_[name] = stack[-1]
+                ip += 2
+            elif op == DEFINE_GLOBAL:
+                globals_[constants[code[ip + 1]]] = pop()
+                ip += 2
+            elif op == CLOSURE:
+                function = constants[code[ip + 1]]
+                captured = tuple(
+                    slots[index] if is_local else cells[index]
+                    for is_local, index in function.free)
+                push(Closure(function, captured))
+                ip += 2
+            elif op == PRINT:
+                print(stringify(pop()))
+                ip += 1
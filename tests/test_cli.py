@@ -0,0 +1,41 @@
+import sys
+
+import pytest
+
+from lox import lox
+
+def main(capsys, monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['plox', *args])
+    with pytest.raises(SystemExit):
+        lox.main()
+    return capsys.readouterr().err.splitlines()[-1]
+
+@pytest.mark.parametrize('args, error', [
+    (['--engine', 'vm', '--dump-python'],
+     '--dump-python needs the python engine'),
+    (['--engine', 'vm', '--max-depth', '100'],
+     '--max-depth needs the stackless engine'),
+    (['--dump-python', '--max-depth', '100'],
+     '--max-depth needs the stackless engine'),
+    (['--max-depth', '100', '--tier-stats'],
+     '--tier-threshold and --tier-stats need the tiered engine'),
+    (['--engine', 'closure', '--tier-stats'],
+     '--tier-threshold and --tier-stats need the tiered engine'),
+    (['--engine', 'tree', '--tier-threshold', '5'],
+     '--tier-threshold and --tier-stats need the tiered engine'),
+    (['--engine', 'vm', '--pool-environments'],
+     '--pool-environments needs one of the engines: stackless, tiered, tree'),
+])
+def test_conflicting_flags(args, error, capsys, monkeypatch):
+    assert main(capsys, monkeypatch, *args) == f'plox: error: {error}'
+
+@pytest.mark.parametrize('engine', [[], ['--engine', 'stackless']])
+def test_flag_picks_engine(engine, capsys, monkeypatch, tmp_path):
+    script = tmp_path / 'deep.lox'
+    script.write_text('fun f(n) { if (n > 0) f(n - 1); }\nf(10);\n')
+    monkeypatch.setattr(
+        sys, 'argv', ['plox', *engine, '--max-depth', '5', str(script)])
+    with pytest.raises(SystemExit) as raised:
+        lox.main()
+    assert raised.value.code == 70
+    assert capsys.readouterr().out == '[Line 1] Stack overflow.\n'
@@ -0,0 +1,461 @@
+import gc
+import tracemalloc
+
+import pytest
+
+from lox import Expr, Stmt, interpreter, lox
+from lox.environment import Environment
+from lox.LoxFunction import LoxFunction
+from lox.stackless import StacklessInterpreter
+from lox.tiered import TieredInterpreter
+from lox.token import Token
+
+ENGINES = sorted(lox.ENGINES)
+
+def run(code, engine, capsys):
+    l = lox.Lox(engine=engine)
+    l.run(code)
+    return l, capsys.readouterr().out.splitlines()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_arithmetic(engine, capsys):
+    _, out = run('print 1 + 2 * 3; print (1 + 2) * 3; print -4 / 2;',
+                 engine, capsys)
+    assert out == ['7.0', '9.0', '-2.0']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_strings_and_logic(engine, capsys):
+    code = '''
+print "a" + "b";
+print nil or "default";
+print false and 1;
+print !nil;
+print 1 == 1;
+print "a" != "a";
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['ab', 'default', 'false', 'true', 'true', 'false']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_scopes(engine, capsys):
+    code = '''
+var a = "global";
+{
+    var a = "outer";
+    {
+        var a = "inner";
+        print a;
+    }
+    a = "assigned";
+    print a;
+}
+print a;
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['inner', 'assigned', 'global']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_loops(engine, capsys):
+    code = '''
+var total = 0;
+for (var i = 0; i < 5; i = i + 1) {
+    total = total + i;
+}
+print total;
+var n = 3;
+while (n > 0) n = n - 1;
+print n;
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['10.0', '0.0']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_recursion(engine, capsys):
+    code = '''
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+print fib(15);
+print fib;
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['610.0', '<fn fib>']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_closures(engine, capsys):
+    code = '''
+fun counter() {
+    var count = 0;
+    fun increment() {
+        count = count + 1;
+        return count;
+    }
+    return increment;
+}
+var first = counter();
+var second = counter();
+first();
+print first();
+print second();
+
+var callbacks = nil;
+for (var i = 0; i < 3; i = i + 1) {
+    var j = i;
+    fun show() { print j; }
+    if (i == 1) callbacks = show;
+}
+callbacks();
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['2.0', '1.0', '1.0']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_nested_closures(engine, capsys):
+    code = '''
+fun outer(a) {
+    var b = 10;
+    fun middle() {
+        var c = 100;
+        fun inner() {
+            a = a + 1;
+            return a + b + c;
+        }
+        return inner;
+    }
+    return middle();
+}
+var f = outer(1);
+f();
+print f();
+
+fun shared() {
+    var n = 0;
+    fun bump() { n = n + 1; }
+    fun get() { return n; }
+    bump();
+    bump();
+    return get;
+}
+print shared()();
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['113.0', '2.0']
+
+def test_blocks_without_declarations(monkeypatch, capsys):
+    created = []
+
+    class CountingEnvironment(Environment):
+        def __init__(self, enclosing=None, size=0):
+            created.append(size)
+            super().__init__(enclosing, size)
+
+    monkeypatch.setattr(interpreter, 'Environment', CountingEnvironment)
+    code = '''
+var total = 0;
+for (var i = 0; i < 100; i = i + 1) {
+    { total = total + i; }
+}
+print total;
+'''
+    _, out = run(code, 'tree', capsys)
+    assert out == ['4950.0']
+    # Only the scope of `i`.
+    assert created == [1]
+
+def test_flat_closures(capsys):
+    code = '''
+fun outer() {
+    var unused = "dead";
+    var kept = "kept";
+    fun inner() { return kept; }
+    return inner;
+}
+var f = outer();
+fun top() {}
+'''
+    l, _ = run(code, 'tree', capsys)
+    inner = l.interpreter.global_env.cells['f'].value
+    assert [cell.value for _, cell in inner.free] == ['kept']
+    assert l.interpreter.global_env.cells['top'].value.free == ()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_return_from_loop(engine, capsys):
+    code = '''
+fun find(limit) {
+    var i = 0;
+    while (true) {
+        if (i >= limit) return i;
+        i = i + 1;
+    }
+}
+fun nothing() { return; }
+print find(4);
+print nothing();
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['4.0', 'nil']
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('code, message', [
+    ('print 1 / 0;', '[Line 1] Cannot divide by zero.'),
+    ('print -"a";', '[Line 1] Operand must be a number.'),
+    ('print "a" + 1;', '[Line 1] Operands must be two numbers or two strings.'),
+    ('print\nundefined;', '[Line 2] Undefined name undefined.'),
+    ('"not callable"();', '[Line 1] Can only call functions and classes.'),
+    ('fun f(a) {}\nf();', '[Line 2] Expected 1 arguments, but got 0.'),
+    ('fun f() { return f; }\nf()(1);',
+     '[Line 2] Expected 0 arguments, but got 1.'),
+])
+def test_runtime_errors(engine, code, message, capsys):
+    l, out = run(code, engine, capsys)
+    assert l.had_runtime_error
+    assert out == [message]
+
+@pytest.mark.parametrize('engine', ['stackless', 'vm'])
+def test_deep_recursion(engine, capsys):
+    code = '''
+fun count(n) {
+    if (n == 0) return 0;
+    return 1 + count(n - 1);
+}
+print count(5000);
+fun forever() { forever(); }
+forever();
+'''
+    l, out = run(code, engine, capsys)
+    assert out == ['5000.0', '[Line 7] Stack overflow.']
+    assert l.had_runtime_error
+
+def test_stackless_max_depth(capsys, monkeypatch):
+    monkeypatch.setattr(StacklessInterpreter, 'max_depth', 100)
+    code = '''
+fun count(n) {
+    if (n == 0) return 0;
+    return 1 + count(n - 1);
+}
+print count(99);
+print count(100);
+'''
+    _, out = run(code, 'stackless', capsys)
+    assert out == ['99.0', '[Line 4] Stack overflow.']
+
+def test_tiered_promotion(capsys, monkeypatch):
+    code = '''
+fun find(limit) {
+    var i = 0;
+    while (true) {
+        if (i >= limit) return i;
+        i = i + 1;
+    }
+}
+for (var n = 0; n < 4; n = n + 1) print find(n);
+'''
+    monkeypatch.setattr(TieredInterpreter, 'threshold', 2)
+    l = lox.Lox(engine='tiered')
+    l.run(code)
+    out = capsys.readouterr().out.splitlines()
+    assert out == ['0.0', '1.0', '2.0', '3.0']
+    promoted = [(p.kind, p.name, p.line) for p in l.interpreter.promotions]
+    assert promoted == [('function', 'find', 2), ('loop', 'for', 9)]
+
+    l.interpreter.report()
+    assert capsys.readouterr().err.splitlines()[0].startswith(
+        '[Line 2] Compiled function find after 2 calls')
+
+def test_promoted_programs_are_released(capsys, monkeypatch):
+    def variables():
+        gc.collect()
+        return sum(isinstance(o, Expr.Variable) for o in gc.get_objects())
+
+    monkeypatch.setattr(TieredInterpreter, 'threshold', 2)
+    code = '''
+fun f(n) { return n; }
+for (var i = 0; i < 3; i = i + 1) f(i);
+'''
+    l = lox.Lox(engine='tiered', memoize=False)
+    l.run(code)
+    before = variables()
+    for _ in range(10):
+        l.run(code)
+    assert variables() == before
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_callees_are_released(engine, capsys):
+    code = '''
+fun call(f) { f(); }
+fun make() {
+    print "made";
+    fun inner() {}
+    return inner;
+}
+call(make());
+'''
+    run(code, engine, capsys)
+    gc.collect()
+    assert not [o for o in gc.get_objects()
+                if isinstance(o, LoxFunction)
+                and o.declaration.name.lexeme == 'inner']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_programs_are_released(engine, capsys):
+    def variables():
+        gc.collect()
+        return sum(isinstance(o, Expr.Variable) for o in gc.get_objects())
+
+    l = lox.Lox(engine=engine)
+    l.run('{ var a = 1; print a; }')
+    before = variables()
+    for _ in range(10):
+        l.run('{ var a = 1; print a; }')
+    assert variables() == before
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_frames_are_released(engine, capsys):
+    l = lox.Lox(engine=engine)
+    # A string of a megabyte, and a function whose frame holds a copy of it.
+    l.run(f'''
+var big{engine} = "x";
+for (var i = 0; i < 20; i = i + 1) big{engine} = big{engine} + big{engine};
+fun copy{engine}() {{
+    var copy = big{engine} + "!";
+    return nil;
+}}
+''')
+    tracemalloc.start()
+    try:
+        l.run(f'for (var i = 0; i < 100; i = i + 1) copy{engine}();')
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert capsys.readouterr().out == ''
+    # No copy outlives its call, and no more than one is alive at a time.
+    assert current < 2**20
+    assert peak < 2 * 2**20
+
+@pytest.mark.parametrize('engine', lox.POOLING_ENGINES)
+def test_pooled_environments(engine, capsys):
+    code = f'''
+fun fib{engine}(n) {{
+    if (n < 2) return n;
+    {{
+        var a = fib{engine}(n - 1);
+        var b = fib{engine}(n - 2);
+        return a + b;
+    }}
+}}
+fun counter{engine}() {{
+    var count = 0;
+    fun increment() {{ count = count + 1; return count; }}
+    return increment;
+}}
+var first{engine} = counter{engine}();
+var second{engine} = counter{engine}();
+first{engine}();
+print first{engine}();
+print second{engine}();
+print fib{engine}(10);
+'''
+    l = lox.Lox(engine=engine, pool_environments=True, memoize=False)
+    l.run(code)
+    assert capsys.readouterr().out.splitlines() == ['2.0', '1.0', '55.0']
+    pool = l.interpreter.pool
+    # Only as many environments as the deepest recursion needs at once.
+    assert pool.allocated < 30
+    assert pool.reused > 200
+    # Free environments hold nothing.
+    for environments, _ in pool.free.values():
+        for environment in environments:
+            assert environment.enclosing == None
+            assert set(environment.values) <= {None}
+
+def test_specialized_nodes(capsys):
+    code = '''
+fun add(a, b) { return a + b; }
+fun below(n) {
+    var count = 0;
+    while (n < 3) { n = n + 1; count = count + 1; }
+    return count;
+}
+print add(1, 2);
+print below(0);
+'''
+    l, out = run(code, 'tree', capsys)
+    assert out == ['3.0', '3.0']
+    add = l.interpreter.global_env.cells['add'].value.declaration.body[0].value
+    loop = l.interpreter.global_env.cells['below'].value.declaration.body[1]
+    assert type(add) is Expr.FloatAdd
+    assert type(loop.condition) is Expr.LocalCompare
+
+    l.run('print add("a", "b"); print add(1, 2); print below("a");')
+    assert capsys.readouterr().out.splitlines() == [
+        'ab', '3.0', '[Line 5] Operand must be a number.']
+    assert type(add) is Expr.GenericBinary
+    assert type(loop.condition) is Expr.GenericBinary
+
+def _subclasses(cls):
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _subclasses(subclass)
+
+@pytest.mark.parametrize('cls', [
+    *_subclasses(Expr.Expr), *_subclasses(Stmt.Stmt), Token])
+def test_no_instance_dict(cls):
+    # Every field has to be declared in `__slots__`.
+    assert cls.__dictoffset__ == 0
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_runtime_error_inside_call(engine, capsys):
+    code = '''
+fun f(n) {
+    while (true) {
+        { var a = n; if (a > 1) return a - "x"; }
+        n = n + 1;
+    }
+}
+print f(0);
+'''
+    l, out = run(code, engine, capsys)
+    assert out == ['[Line 4] Operand must be a number.']
+    l.run('var b = 2; print b;')
+    assert capsys.readouterr().out.splitlines() == ['2.0']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_tail_calls(engine, capsys):
+    code = '''
+fun sum(n, total) {
+    if (n == 0) return total;
+    return sum(n - 1, total + n);
+}
+print sum(5000, 0);
+
+fun even(n) {
+    if (n == 0) return true;
+    return odd(n - 1);
+}
+fun odd(n) {
+    if (n == 0) return false;
+    return even(n - 1);
+}
+print even(5001);
+'''
+    _, out = run(code, engine, capsys)
+    assert out == ['12502500.0', 'false']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_global_redefinition(engine, capsys):
+    # Globals are shared by all interpreters, so every engine uses its own.
+    l, out = run(f'''
+fun get() {{ return later{engine}; }}
+print get();
+''', engine, capsys)
+    assert out == [f'[Line 2] Undefined name later{engine}.']
+    l.run(f'''
+var later{engine} = 1;
+print get();
+var later{engine} = 2;
+print get();
+later{engine} = 3;
+print get();
+''')
+    assert capsys.readouterr().out.splitlines() == ['1.0', '2.0', '3.0']
@@ -0,0 +1,112 @@
+import pytest
+
+from lox import lox
+
+ENGINES = lox.MEMOIZING_ENGINES
+
+def run(code, engine, capsys, memoize=True):
+    l = lox.Lox(engine=engine, memoize=memoize)
+    l.run(code)
+    return l, capsys.readouterr().out.splitlines()
+
+def memos(l):
+    return {memo.declaration.name.lexeme: (memo.hits, memo.misses)
+            for memo in l.interpreter.memos}
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_fib(engine, capsys):
+    code = f'''
+fun fib{engine}(n) {{
+    if (n < 2) return n;
+    return fib{engine}(n - 1) + fib{engine}(n - 2);
+}}
+print fib{engine}(40);
+print fib{engine}(40);
+'''
+    l, out = run(code, engine, capsys)
+    assert out == ['102334155.0', '102334155.0']
+    assert memos(l) == {f'fib{engine}': (39, 41)}
+
+@pytest.mark.parametrize('code', [
+    'fun f(x) { print x; return x; }',
+    'var total = 0; fun f(x) { total = total + x; return total; }',
+    'fun f(x) { fun g() { return x; } return g; }',
+    'fun f(x) { return x(); }',
+    'fun f(x) { var g = x; return g(); }',
+    'fun outer(y) { fun f(x) { return x + y; } return f; } outer(1);',
+])
+def test_impure(code, capsys):
+    l = lox.Lox()
+    l.run(code)
+    assert memos(l) == {}
+
+def test_changed_globals(capsys):
+    code = '''
+var k = 1;
+fun addk(x) { return x + k; }
+print addk(1);
+k = 2;
+print addk(1);
+fun one() { return 1; }
+fun callone() { return one(); }
+print callone();
+fun one() { return "one"; }
+print callone();
+fun time() { return clock(); }
+print time() == time();
+'''
+    l, out = run(code, 'tree', capsys)
+    assert out == ['2.0', '3.0', '1.0', 'one', 'false']
+    assert memos(l)['time'] == (0, 0)
+
+def test_argument_types(capsys):
+    l, out = run('fun id(x) { return x; } print id(1); print id(true);',
+                 'tree', capsys)
+    assert out == ['1.0', 'true']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_signed_zero(engine, capsys):
+    code = 'fun id(x) { return x; } print id(0); print id(-0); print id(0);'
+    _, out = run(code, engine, capsys)
+    assert out == ['0.0', '-0.0', '0.0']
+
+def test_memoized_tail_calls(capsys):
+    code = '''
+fun countdown(n) {
+    if (n == 0) return "done";
+    return countdown(n - 1);
+}
+print countdown(500);
+print countdown(500);
+'''
+    l, out = run(code, 'tree', capsys)
+    assert out == ['done', 'done']
+    assert memos(l) == {'countdown': (1, 501)}
+
+def test_abandoned(capsys):
+    l, out = run('''
+fun sq(x) { return x * x; }
+var total = 0;
+for (var i = 0; i < 2000; i = i + 1) total = total + sq(i);
+print total;
+''', 'tree', capsys)
+    assert out == ['2664667000.0']
+    # Given up on when the table filled up without any reuse.
+    assert memos(l) == {'sq': (0, 1025)}
+    assert [str(memo) for memo in l.interpreter.memos] == [
+        '[Line 2] Memoized sq: 0 hits, 1025 misses, abandoned']
+
+def test_opt_out(capsys):
+    l, out = run('fun sq(x) { return x * x; } print sq(3); print sq(3);',
+                 'tree', capsys, memoize=False)
+    assert out == ['9.0', '9.0']
+    assert l.interpreter.memos == []
+
+def test_bounded(capsys, monkeypatch):
+    monkeypatch.setattr(lox.Interpreter, 'memo_size', 2)
+    l, _ = run('''
+fun sq(x) { return x * x; }
+sq(1); sq(2); sq(1); sq(3); sq(2); sq(1);
+''', 'tree', capsys)
+    # `sq(3)` evicts `sq(2)`, which then evicts `sq(1)`.
+    assert memos(l) == {'sq': (1, 5)}
@@ -0,0 +1,101 @@
+import pytest
+
+from lox import lox
+
+ENGINES = sorted(lox.ENGINES)
+
+def optimize(code, capsys, engine='tree'):
+    l = lox.Lox(engine=engine, show_optimizations=True)
+    l.run(code)
+    captured = capsys.readouterr()
+    return captured.out.splitlines(), captured.err.splitlines()
+
+def test_folding(capsys):
+    out, optimizations = optimize('''
+print 1 + 2 * 3;
+print "a" + "b" == "ab";
+print !nil;
+print nil or -2;
+print false and x;
+''', capsys)
+    assert out == ['7.0', 'true', 'true', '-2.0', 'false']
+    assert optimizations == [
+        '[Line 2] Folded (* 2.0 3.0) into 6.0',
+        '[Line 2] Folded (+ 1.0 6.0) into 7.0',
+        '[Line 3] Folded (+ "a" "b") into "ab"',
+        '[Line 3] Folded (== "ab" "ab") into true',
+        '[Line 4] Folded (! nil) into true',
+        '[Line 5] Folded (- 2.0) into -2.0',
+        '[Line 5] Folded (or nil -2.0) into -2.0',
+        '[Line 6] Folded (and false x) into false',
+    ]
+
+@pytest.mark.parametrize('code, error', [
+    ('print 1 / 0;', 'Cannot divide by zero.'),
+    ('print "a" - 1;', 'Operand must be a number.'),
+    ('print -"a";', 'Operand must be a number.'),
+    ('print 1 + "a";', 'Operands must be two numbers or two strings.'),
+])
+def test_runtime_errors_are_not_folded(code, error, capsys):
+    out, optimizations = optimize(code, capsys)
+    assert out == [f'[Line 1] {error}']
+    assert optimizations == []
+
+def test_dead_branches(capsys):
+    out, optimizations = optimize('''
+if (true) print "then"; else print "else";
+if (1 > 2) print "then"; else print "else";
+if (false) print "never";
+while (nil) print "never";
+for (;false;) print "never";
+''', capsys)
+    assert out == ['then', 'else']
+    assert optimizations == [
+        '[Line 2] Removed if (true), keeping its then branch',
+        '[Line 3] Folded (> 1.0 2.0) into false',
+        '[Line 3] Removed if (false), keeping its else branch',
+        '[Line 4] Removed if (false)',
+        '[Line 5] Removed while loop which never runs',
+        '[Line 6] Removed for loop which never runs',
+    ]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_hoisting(engine, capsys):
+    out, optimizations = optimize('''
+fun sum(n) {
+    var total = 0;
+    for (var i = 0; i < n * 2 - 1; i = i + 1) {
+        total = total + i;
+    }
+    return total;
+}
+print sum(3);
+''', capsys, engine)
+    assert out == ['10.0']
+    assert optimizations == [
+        '[Line 4] Hoisted (- (* n 2.0) 1.0) out of for loop']
+
+@pytest.mark.parametrize('code', [
+    # `n` changes in the loop.
+    'var n = 3; while (0 < n - 1) n = n - 1;',
+    # A call could change the global `n`.
+    'var n = 3; fun f() { n = 0; } while (0 < n - 1) f();',
+    # `i < n + 1` fails before `n + 1` would be evaluated.
+    'var i = "i"; var n = 1; while (i < n + 1) i = i + 1;',
+    # `n + 1` may not be evaluated at all.
+    'var i = 0; var n = 1; while (i > 5 and i < n + 1) i = i + 1;',
+])
+def test_not_hoisted(code, capsys):
+    _, optimizations = optimize(code, capsys)
+    assert not any('Hoisted' in line for line in optimizations)
+
+def test_hoisted_errors(capsys):
+    out, optimizations = optimize('''
+fun f(n) {
+    print "before";
+    for (var i = 0; i < n * 2; i = i + 1) print i;
+}
+f("n");
+''', capsys)
+    assert out == ['before', '[Line 4] Operand must be a number.']
+    assert optimizations == ['[Line 4] Hoisted (* n 2.0) out of for loop']
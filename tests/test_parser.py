@@ -0,0 +1,118 @@
+import pytest
+
+from lox import lox
+from lox.ast_printer import ASTPrinter
+from lox.parser import Parser
+from lox.scanner import Scanner
+
+from . import l
+
+ENGINES = sorted(lox.ENGINES)
+
+def parse(code, l, max_depth=None):
+    return Parser(Scanner(code, l).scan(), l, max_depth).parse()
+
+@pytest.mark.parametrize('code, tree', [
+    ('1 + 2 * 3 - 4;', '(- (+ 1.0 (* 2.0 3.0)) 4.0)'),
+    ('1 - 2 - 3;', '(- (- 1.0 2.0) 3.0)'),
+    ('a = b = c;', '(= a (= b c))'),
+    ('-a * !b;', '(* (- a) (! b))'),
+    ('--f(1)(2);', '(- (- (call (call f 1.0) 2.0)))'),
+    ('(a)(b, c + 1);', '(call (group a) b (+ c 1.0))'),
+    ('a or b and c == d < e;', '(or a (and b (== c (< d e))))'),
+    ('x != true == nil or "s" >= 1 / 2;',
+     '(or (== (!= x true) nil) (>= "s" (/ 1.0 2.0)))'),
+])
+def test_precedence(code, tree, l):
+    [statement] = parse(code, l)
+    assert ASTPrinter().pprint_ast(statement.expression) == tree
+
+@pytest.mark.parametrize('code, errors', [
+    ('1 +;', ["[Line 1] Error at ';': Expect expression."]),
+    ('(1 + 2;', ["[Line 1] Error at ';': Expect ')' after expression."]),
+    ('a + b = c;', ["[Line 1] Error at '=': Invalid assignment target."]),
+    ('f(1, 2;', ["[Line 1] Error at ';': Expected ')' after arguments."]),
+    ('print 1 *', ["[Line 1] Error at end: Expect expression."]),
+])
+def test_errors(code, errors, l, capsys):
+    parse(code, l)
+    assert l.had_error
+    assert capsys.readouterr().out.splitlines() == errors
+
+DEEP = {
+    'parentheses': lambda n: 'print ' + '(' * n + '1' + ')' * n + ';',
+    'unary': lambda n: 'print ' + '-' * n + '1;',
+    'assignments': lambda n: 'a = ' * n + '1;',
+    'calls': lambda n: 'print ' + 'f(' * n + '1' + ')' * n + ';',
+    'operands': lambda n: 'print ' + '1 + (' * n + '1' + ')' * n + ';',
+    'blocks': lambda n: '{' * n + 'print 1;' + '}' * n,
+    'for loops': lambda n: 'for (var i = 0; i < 1; i = i + 1) ' * n + 'i;',
+    'else if': lambda n: 'if (a) print 0; ' + 'else if (a) print 0; ' * n,
+    'functions': lambda n: 'fun f() {' * n + 'return 1;' + '}' * n,
+}
+
+@pytest.mark.parametrize('nesting', DEEP.values(), ids=DEEP)
+def test_deep_nesting(nesting, l, capsys):
+    # A `for` nests three statements deep, once desugared.
+    statements = parse(nesting(20000), l, max_depth=70000)
+    assert not l.had_error
+    assert len(statements) == 1
+
+    l = lox.Lox()
+    l.run(nesting(1000))
+    assert l.had_error
+    assert 'Too deeply nested.' in capsys.readouterr().out
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_nesting_limit(engine, capsys):
+    depth = Parser.max_depth
+    # Every `{`, and every `(` and `-`, nests one level deeper.
+    code = '{' * (depth // 2) + 'print ' + '-(' * (depth // 4) + '1' + \
+           ')' * (depth // 4) + ';' + '}' * (depth // 2)
+    lox.Lox(engine=engine).run(code)
+    assert capsys.readouterr().out.splitlines() == ['1.0']
+
+    code = '{' * depth + 'print (1);' + '}' * depth
+    lox.Lox(engine=engine).run(code)
+    assert capsys.readouterr().out.splitlines()[0] == \
+        "[Line 1] Error at '1': Too deeply nested."
+    lox.Lox(engine=engine, max_nesting=depth + 1).run(code)
+    assert capsys.readouterr().out.splitlines() == ['1.0']
+
+    # Every `for` with an initializer and an incrementor nests three levels
+    # deeper: a block, the loop, and another block.
+    loop = 'for (var i = 0; i < 1; i = i + 1) '
+    code = loop * (depth // 3) + 'print i;'
+    lox.Lox(engine=engine).run(code)
+    assert capsys.readouterr().out.splitlines() == ['0.0']
+    code = loop * (depth // 3 + 1) + 'print i;'
+    lox.Lox(engine=engine).run(code)
+    assert capsys.readouterr().out.splitlines() == [
+        "[Line 1] Error at 'print': Too deeply nested."]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_nesting_beyond_python_stack(engine, capsys):
+    code = 'for (var i = 0; i < 1; i = i + 1) ' * 1000 + '\nprint i;'
+    l = lox.Lox(engine=engine, max_nesting=10000)
+    l.run(code)
+    assert l.had_error
+    assert capsys.readouterr().out.splitlines() == [
+        "[Line 2] Error at 'print': Too deeply nested."]
+
+def test_operator_chain_beyond_python_stack(capsys):
+    l = lox.Lox()
+    l.run('print 1' + ' + 1' * 5000 + ';')
+    assert l.had_error
+    assert capsys.readouterr().out.splitlines() == [
+        "[Line 1] Error at '1': Too deeply nested."]
+
+def test_deep_recursion_isnt_nesting(capsys):
+    # Nested deeper than by default, but runs out of stack on Lox calls.
+    depth = Parser.max_depth + 10
+    code = '{' * depth + \
+           'fun f(n) { if (n > 0) f(n - 1); } f(5000);' + '}' * depth
+    l = lox.Lox(max_nesting=depth + 10)
+    with pytest.raises(RecursionError):
+        l.run(code)
+    assert not l.had_error
+    assert 'Too deeply nested.' not in capsys.readouterr().out
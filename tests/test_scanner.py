@@ -1,4 +1,9 @@
+import tracemalloc
+
+from lox import lox
+from lox.parser import Parser
 from lox.scanner import Scanner
+from lox import tokentype
 from lox.tokentype import TokenType
 
 from . import l
@@ -181,3 +186,117 @@ def test_ignore_inline_comments(l):
     expected = [TokenType.VAR, TokenType.IDENTIFIER, TokenType.EQUAL,
     TokenType.NUMBER, TokenType.SEMICOLON]
     return code, expected
+
+def test_token_kinds_are_ints(l):
+    token = get_tokens("+", l)[0]
+    assert token.tokentype == int(TokenType.PLUS)
+    assert str(token.tokentype) == 'TokenType.PLUS'
+
+def test_token_kind_constants():
+    constants = {name: getattr(tokentype, name, None)
+                 for name in TokenType.__members__}
+    assert constants == TokenType.__members__
+
+def test_bulk_scanning_matches_scan_token(capsys):
+    code = '''\
+var café = 1.5; // Non-ASCII letters and digits are scanned one by one.
+print café+٣ * 2.5é
+  "multi
+line" != x1.y;
+@ _ 1.'''
+    def scan(bulk, compact=False):
+        l = lox.Lox()
+        scanner = Scanner(code, l, bulk=bulk)
+        tokens = scanner.scan_compact() if compact else scanner.scan_tokens()
+        errors = capsys.readouterr().out
+        return [(t.tokentype, t.lexeme, t.literal, t.line)
+                for t in tokens], errors
+
+    tokens, errors = scan(True)
+    assert (tokens, errors) == scan(False)
+    assert (tokens, errors) == scan(True, compact=True)
+    assert (tokens, errors) == scan(False, compact=True)
+    assert [lexeme for _, lexeme, _, _ in tokens] == [
+        'var', 'café', '=', '1.5', ';',
+        'print', 'café', '+', '٣', '*', '2.5', 'é',
+        '"multi\nline"', '!=', 'x1', '.', 'y', ';',
+        '1', '.', '']
+    assert tokens[12][3] == 4
+    assert errors.splitlines() == [
+        "[Line 4] Error at ';': Unexpected character.",
+        "[Line 4] Error at ';': Unexpected character."]
+
+def test_streamed_tokens(capsys):
+    code = ''.join(f'''
+fun f{i}(a, b) {{
+    var total = a * {i}.5 + b;
+    if (total >= 100) print "big"; else total = total - 1;
+    return total;
+}}
+''' for i in range(200))
+
+    def parse(stream):
+        l = lox.Lox()
+        scanner = Scanner(code, l)
+        tracemalloc.start()
+        try:
+            tokens = scanner.scan() if stream else scanner.scan_tokens()
+            statements = Parser(tokens, l).parse()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return len(statements), peak
+
+    streamed, streamed_peak = parse(True)
+    listed, listed_peak = parse(False)
+    assert streamed == listed == 200
+    # The tokens which don't end up in the tree are dropped right away.
+    assert streamed_peak < 0.8 * listed_peak
+
+def test_errors_while_streaming(capsys):
+    code = 'print 1 +;\nprint @;\nprint "a;'
+    lox.Lox().run(code)
+    # Scan and parse errors are reported in the order of the source.
+    assert capsys.readouterr().out.splitlines() == [
+        "[Line 1] Error at ';': Expect expression.",
+        "[Line 2] Error at 'print': Unexpected character.",
+        "[Line 2] Error at ';': Expect expression.",
+        "[Line 3] Error at 'print': Unterminated string.",
+        "[Line 3] Error at end: Expect expression.",
+    ]
+    lox.Lox(stream_tokens=False).run(code)
+    assert capsys.readouterr().out.splitlines() == [
+        "[Line 2] Error at 'print': Unexpected character.",
+        "[Line 3] Error at 'print': Unterminated string.",
+        "[Line 1] Error at ';': Expect expression.",
+        "[Line 2] Error at ';': Expect expression.",
+        "[Line 3] Error at end: Expect expression.",
+    ]
+
+def test_compact_tokens(capsys):
+    code = ''.join(f'''
+var s{i} = "string {i}"; // comment
+print s{i} + "!" == nil or {i}.5 >= -{i};
+''' for i in range(1000))
+
+    def scan(compact):
+        scanner = Scanner(code, lox.Lox())
+        tracemalloc.start()
+        try:
+            tokens = scanner.scan_compact() if compact else scanner.scan_tokens()
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return tokens, size
+
+    tokens, size = scan(False)
+    compact, compact_size = scan(True)
+    assert len(compact) == len(tokens) == 17001
+    assert compact[-1].tokentype == TokenType.EOF
+    assert ([(t.tokentype, t.lexeme, t.literal, t.line) for t in compact] ==
+            [(t.tokentype, t.lexeme, t.literal, t.line) for t in tokens])
+    assert compact_size * 8 < size
+
+    l = lox.Lox(compact_tokens=True)
+    l.run('var a = "compact"; print a + " tokens"; print 1.5 * 2;')
+    assert capsys.readouterr().out.splitlines() == ['compact tokens', '3.0']
@@ -0,0 +1,65 @@
+import re
+
+import pytest
+
+from lox import lox
+
+def run(code, capsys, **options):
+    l = lox.Lox(engine='python')
+    for name, value in options.items():
+        setattr(l.interpreter, name, value)
+    l.run(code)
+    return capsys.readouterr()
+
+def test_boxed_locals(capsys):
+    code = '''
+fun counters() {
+    var first;
+    for (var i = 0; i < 2; i = i + 1) {
+        var count = i * 10;
+        fun next() {
+            count = count + 1;
+            return count;
+        }
+        if (first == nil) first = next;
+    }
+    return first;
+}
+var next = counters();
+print next();
+print next();
+'''
+    out = run(code, capsys, dump_source=True)
+    # Every closure keeps the box of the `count` of its own iteration.
+    assert out.out.splitlines() == ['1.0', '2.0']
+    assert re.search(r'count_\d+ = \[', out.err)
+    assert re.search(r'def _next_\d+\(\*, (count_\d+)=\1\):', out.err)
+
+def test_tail_calls(capsys):
+    code = '''
+fun zero() { return 0; }
+fun one(x) { return zero(); }
+fun two(x, y) { return one(x); }
+print two(1, 2);
+'''
+    out = run(code, capsys, dump_source=True)
+    assert out.out.splitlines() == ['0.0']
+    assert 'TailCall(' in out.err
+    assert '# Not compiled' not in out.err
+
+def test_dump_source(capsys):
+    out = run('var a = 1; print a + 2;', capsys, dump_source=True)
+    assert out.out.splitlines() == ['3.0']
+    assert out.err.startswith('def _main():\n')
+    assert "_define_global('a', 1.0)" in out.err
+
+@pytest.mark.parametrize('code', [
+    # More statically nested blocks than CPython allows.
+    'var i = 0; ' + 'while (i < 1) ' * 21 + 'i = i + 1; print i;',
+    # More indentation than CPython allows.
+    'fun f() {' * 100 + 'return 1;' + '}' * 100 + 'print f;',
+])
+def test_not_compiled(code, capsys):
+    out = run(code, capsys, dump_source=True)
+    assert out.out.splitlines() in (['1.0'], ['<fn f>'])
+    assert '# Not compiled: ' in out.err